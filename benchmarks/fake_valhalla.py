@@ -0,0 +1,85 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from polyline import encode
+
+
+class TraceRouteHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for Valhalla's /trace_route with format=osrm: every input
+    point is "matched" to itself and the geometry is the input polyline.
+    """
+
+    latency = 0.0
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/trace_route":
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length))
+        shape = payload.get("shape", [])
+        if len(shape) < 2:
+            self.send_error(400, "Insufficient shape points")
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps(
+            {
+                "tracepoints": [
+                    {"location": [p["lon"], p["lat"]]} for p in shape
+                ],
+                "matchings": [
+                    {
+                        "geometry": encode(
+                            [(p["lat"], p["lon"]) for p in shape], precision=6
+                        )
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency_ms=0):
+    """
+    Starts the fake server in a background thread. Returns (server, url);
+    call server.shutdown() to stop it.
+    """
+    handler = type(
+        "Handler", (TraceRouteHandler,), {"latency": latency_ms / 1000}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/trace_route"
+    return server, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a fake Valhalla /trace_route endpoint for benchmarks."
+    )
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="Artificial delay per request"
+    )
+    args = parser.parse_args()
+
+    server, url = start_server(args.port, args.latency_ms)
+    print(f"Fake Valhalla listening on {url}. Press Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,266 @@
+import argparse
+import collections
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import Json
+
+# Database configuration
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "prague",
+    "user": "postgres",
+    "port": "25432",
+}
+
+STAGE_MARKER = re.compile(r"^-- stage: (\S+)\s*$", re.MULTILINE)
+
+CREATE_RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+  run_id text,
+  script text,
+  stage_order integer,
+  stage text,
+  started_at timestamptz,
+  wall_seconds float,
+  rows_inserted bigint,
+  rows_updated bigint,
+  rows_deleted bigint,
+  temp_bytes bigint,
+  plans jsonb,
+  PRIMARY KEY (run_id, script, stage_order)
+);
+"""
+
+# Filas modificadas dentro de la transaccion actual, en todas las tablas del usuario
+XACT_ROWS = """
+SELECT COALESCE(SUM(n_tup_ins), 0), COALESCE(SUM(n_tup_upd), 0), COALESCE(SUM(n_tup_del), 0)
+FROM pg_stat_xact_user_tables;
+"""
+
+
+def split_stages(path):
+    """
+    Splits an importer script at its `-- stage: <name>` markers.
+    Returns a list of (name, sql); anything before the first marker is skipped
+    when it only contains comments.
+    """
+    with open(path) as f:
+        text = f.read()
+    parts = STAGE_MARKER.split(text)
+    stages = []
+    preamble = parts[0]
+    if any(
+        line.strip() and not line.strip().startswith("--")
+        for line in preamble.splitlines()
+    ):
+        stages.append(("preamble", preamble))
+    for name, sql in zip(parts[1::2], parts[2::2]):
+        stages.append((name, sql))
+    return stages
+
+
+def read_temp_bytes(conn):
+    """
+    Cumulative temp-file bytes of the current database. Statistics are flushed
+    asynchronously, so on PostgreSQL 15+ a flush is forced first.
+    """
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT pg_stat_force_next_flush();")
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+        cur.execute("SELECT pg_stat_clear_snapshot();")
+        cur.execute(
+            "SELECT temp_bytes FROM pg_stat_database WHERE datname = current_database();"
+        )
+        temp_bytes = cur.fetchone()[0]
+    conn.commit()
+    return temp_bytes
+
+
+def enable_plan_capture(conn):
+    """
+    Uses auto_explain to send the EXPLAIN (ANALYZE, BUFFERS) plan of every
+    statement, including those inside DO blocks, back to the client as notices.
+    """
+    with conn.cursor() as cur:
+        cur.execute("LOAD 'auto_explain';")
+        cur.execute("SET auto_explain.log_min_duration = 0;")
+        cur.execute("SET auto_explain.log_analyze = on;")
+        cur.execute("SET auto_explain.log_buffers = on;")
+        cur.execute("SET auto_explain.log_nested_statements = on;")
+        cur.execute("SET auto_explain.log_format = 'json';")
+        cur.execute("SET auto_explain.log_level = 'notice';")
+    conn.commit()
+
+
+def run_stage(conn, name, sql):
+    """Runs one stage in its own transaction and returns its measurements."""
+    temp_before = read_temp_bytes(conn)
+    # Se descartan los planes de las consultas de medicion: solo cuentan los de la etapa
+    conn.notices.clear()
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        notices = list(conn.notices)
+        cur.execute(XACT_ROWS)
+        inserted, updated, deleted = cur.fetchone()
+    conn.commit()
+    wall_seconds = time.perf_counter() - start
+
+    plans = [n.split("plan:", 1)[1].strip() for n in notices if "plan:" in n]
+    messages = [n.strip() for n in notices if "plan:" not in n]
+    return {
+        "stage": name,
+        "started_at": started_at.isoformat(),
+        "wall_seconds": wall_seconds,
+        "rows_inserted": int(inserted),
+        "rows_updated": int(updated),
+        "rows_deleted": int(deleted),
+        "temp_bytes": int(read_temp_bytes(conn) - temp_before),
+        "plans": plans,
+        "messages": messages,
+    }
+
+
+def previous_run(conn, script, run_id):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT stage, wall_seconds
+            FROM pipeline_runs
+            WHERE script = %s AND run_id = (
+              SELECT MAX(run_id) FROM pipeline_runs WHERE script = %s AND run_id < %s
+            );
+            """,
+            (script, script, run_id),
+        )
+        rows = dict(cur.fetchall())
+    conn.commit()
+    return rows
+
+
+def save_run(conn, run_id, script, results):
+    with conn.cursor() as cur:
+        for order, r in enumerate(results, start=1):
+            cur.execute(
+                """
+                INSERT INTO pipeline_runs (run_id, script, stage_order, stage, started_at,
+                                           wall_seconds, rows_inserted, rows_updated,
+                                           rows_deleted, temp_bytes, plans)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                """,
+                (
+                    run_id,
+                    script,
+                    order,
+                    r["stage"],
+                    r["started_at"],
+                    r["wall_seconds"],
+                    r["rows_inserted"],
+                    r["rows_updated"],
+                    r["rows_deleted"],
+                    r["temp_bytes"],
+                    Json([json.loads(p) for p in r["plans"]]) if r["plans"] else None,
+                ),
+            )
+    conn.commit()
+
+
+def run_script(conn, path, run_id, entry, stages_filter=None):
+    """
+    Runs the stages of one script, appending their measurements to
+    entry["stages"] as they finish. If a stage fails, the stages completed so
+    far are still saved and the failing one is recorded in entry["failed_stage"].
+    """
+    script = entry["script"]
+    results = entry["stages"]
+    baseline = previous_run(conn, script, run_id)
+    try:
+        for name, sql in split_stages(path):
+            if stages_filter and name not in stages_filter:
+                continue
+            print(f"...{script}: {name}")
+            try:
+                results.append(run_stage(conn, name, sql))
+            except Exception:
+                entry["failed_stage"] = name
+                if not conn.closed:
+                    conn.rollback()
+                raise
+    finally:
+        if not conn.closed:
+            save_run(conn, run_id, script, results)
+        for r in results:
+            if r["stage"] in baseline and baseline[r["stage"]]:
+                r["previous_wall_seconds"] = baseline[r["stage"]]
+
+
+def print_report(report):
+    for entry in report["scripts"]:
+        print(f"\n{entry['script']}")
+        header = f"{'stage':<34}{'seconds':>10}{'inserted':>12}{'updated':>12}{'deleted':>12}{'temp MB':>10}"
+        print(header)
+        print("-" * len(header))
+        total = sum(r["wall_seconds"] for r in entry["stages"])
+        for r in entry["stages"]:
+            line = (
+                f"{r['stage']:<34}{r['wall_seconds']:>10.2f}{r['rows_inserted']:>12}"
+                f"{r['rows_updated']:>12}{r['rows_deleted']:>12}{r['temp_bytes'] / 2**20:>10.1f}"
+            )
+            if "previous_wall_seconds" in r:
+                change = r["wall_seconds"] / r["previous_wall_seconds"] - 1
+                line += f"  ({change:+.1%} vs previous run)"
+            if total:
+                line += f"  [{r['wall_seconds'] / total:.0%}]"
+            print(line)
+        if "failed_stage" in entry:
+            print(f"{entry['failed_stage']:<34}{'FAILED':>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the SQL importers stage by stage, recording timings into pipeline_runs."
+    )
+    parser.add_argument("scripts", nargs="+", help="Importer SQL scripts to run, in order")
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Capture EXPLAIN (ANALYZE, BUFFERS) plans of every statement via auto_explain",
+    )
+    parser.add_argument(
+        "--stages", nargs="*", help="Only run these stages (default: all)"
+    )
+    parser.add_argument("--output", default="pipeline_run.json")
+    args = parser.parse_args()
+
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    conn = psycopg2.connect(**DB_CONFIG)
+    # psycopg2 keeps only the last 50 notices in a list; plans need all of them
+    conn.notices = collections.deque()
+    with conn.cursor() as cur:
+        cur.execute(CREATE_RUNS_TABLE)
+    conn.commit()
+    if args.explain:
+        enable_plan_capture(conn)
+
+    report = {"run_id": run_id, "scripts": []}
+    try:
+        for path in args.scripts:
+            entry = {"script": os.path.basename(path), "stages": []}
+            report["scripts"].append(entry)
+            run_script(conn, path, run_id, entry, args.stages)
+    finally:
+        # Si una etapa falla, igual se informan las que terminaron antes de propagar el error
+        conn.close()
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+        print(f"\nReport saved to {args.output}")
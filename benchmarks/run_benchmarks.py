@@ -0,0 +1,240 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "gtfs_realtime"))
+
+import fake_valhalla
+import synthetic_data
+from definitions import gtfs_realtime_pb2
+import gtfs_rt_inspector
+import map_matching
+
+SQL_SCRIPTS = [
+    os.path.join(ROOT, "gtfs_schedule", "mdb_importer_scheduled.sql"),
+    os.path.join(ROOT, "gtfs_realtime", "mdb_importer_realtime_new.sql"),
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def reset_peak_rss():
+    """Resets the peak RSS (VmHWM) of this process. Linux only; elsewhere a no-op."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(who):
+    if who == resource.RUSAGE_SELF:
+        # VmHWM se puede reiniciar por etapa; ru_maxrss es el pico desde que arranco el proceso
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 2**10
+        except OSError:
+            pass
+    # ru_maxrss esta en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_isolated(func, *args):
+    """
+    Runs a benchmark stage in a fresh process, so the memory peaks it reports
+    are its own and not those of earlier stages.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(func, *args).result()
+
+
+def measure(name, func, items):
+    """
+    Calls `func` once per item and reports throughput, per-item latency
+    percentiles and the peak resident memory during the call of the stage
+    process and of its finished child processes (worker pools, psql).
+    Stages run through run_isolated, so the child peak covers only them.
+    """
+    reset_peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "stage": name,
+        "items": len(latencies),
+        "seconds": elapsed,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else None,
+        "latency_ms": {
+            f"p{q}": percentile(latencies, q) * 1000 if latencies else None
+            for q in (50, 95, 99, 100)
+        },
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def bench_feed_parsing(dataset_dir):
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(dataset_dir, "realtime", "*.pb"))):
+        with open(path, "rb") as f:
+            snapshots.append(f.read())
+
+    def parse(raw):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(raw)
+        gtfs_rt_inspector.extract_vehicle_positions(feed)
+
+    return measure("gtfs_rt_parse", parse, snapshots)
+
+
+def load_positions(dataset_dir):
+    df = pd.read_parquet(os.path.join(dataset_dir, "vehicle_positions.parquet"))
+    geometry = [Point(lon, lat) for lat, lon in zip(df["latitude"], df["longitude"])]
+    return gpd.GeoDataFrame(df, geometry=geometry)
+
+
+def bench_map_matching(dataset_dir, latency_ms):
+    server, url = fake_valhalla.start_server(latency_ms=latency_ms)
+    map_matching.VALHALLA_URL = url
+    try:
+        gdf = load_positions(dataset_dir)
+        trips = list(
+            map_matching.prepare_trips(map_matching.prefilter_points(gdf)).items()
+        )
+        failed_log = []
+        per_trip = measure(
+            "map_match_trip",
+            lambda trip: map_matching.map_match_trip(
+                trip[1], failed_log, vehicle_id=trip[0][0], trip_id=trip[0][1]
+            ),
+            trips,
+        )
+        pipeline = measure(
+            "run_map_matching", map_matching.run_map_matching, [gdf]
+        )
+        pipeline["points"] = len(gdf)
+        pipeline["points_per_s"] = len(gdf) / pipeline["seconds"]
+    finally:
+        server.shutdown()
+    return [per_trip, pipeline]
+
+
+def bench_sql_importers(psql_command):
+    """Times each importer script; the synthetic GTFS must already be loaded."""
+
+    def run(script):
+        subprocess.run(
+            shlex.split(psql_command) + ["-v", "ON_ERROR_STOP=1", "-q", "-f", script],
+            check=True,
+            cwd=os.path.dirname(script),
+            stdout=subprocess.DEVNULL,
+        )
+
+    return [measure(os.path.basename(script), run, [script]) for script in SQL_SCRIPTS]
+
+
+def compare_with_baseline(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["stage"]: r for r in json.load(f)["results"]}
+    for result in results:
+        previous = baseline.get(result["stage"])
+        if previous and previous.get("throughput_per_s") and result["throughput_per_s"]:
+            change = result["throughput_per_s"] / previous["throughput_per_s"] - 1
+            result["throughput_change"] = change
+
+
+def print_report(results):
+    header = f"{'stage':<32}{'items':>8}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>10}{'child MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        lat = r["latency_ms"]
+        line = (
+            f"{r['stage']:<32}{r['items']:>8}{r['throughput_per_s'] or 0:>12.1f}"
+            f"{lat['p50'] or 0:>10.2f}{lat['p95'] or 0:>10.2f}{lat['p99'] or 0:>10.2f}"
+            f"{r['peak_rss_mb']:>10.1f}{r['children_peak_rss_mb']:>10.1f}"
+        )
+        if "throughput_change" in r:
+            line += f"  ({r['throughput_change']:+.1%} vs baseline)"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the GTFS / GTFS-RT pipeline on synthetic data."
+    )
+    parser.add_argument(
+        "--dataset",
+        help="Existing dataset from synthetic_data.py; generated in a temp dir if omitted",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--trips-per-route", type=int, default=10)
+    parser.add_argument(
+        "--valhalla-latency-ms",
+        type=float,
+        default=0,
+        help="Artificial latency of the fake Valhalla server",
+    )
+    parser.add_argument(
+        "--psql",
+        help='psql command used to benchmark the SQL importers, e.g. "psql -h localhost -U postgres -p 25432 -d prague"',
+    )
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+
+    dataset_dir = args.dataset
+    if dataset_dir is None:
+        dataset_dir = tempfile.mkdtemp(prefix="gtfs_bench_")
+        schedule = synthetic_data.generate_schedule(
+            seed=args.seed, routes=args.routes, trips_per_route=args.trips_per_route
+        )
+        positions = synthetic_data.generate_vehicle_positions(schedule, seed=args.seed)
+        feeds = synthetic_data.generate_feed_snapshots(positions)
+        synthetic_data.write_dataset(dataset_dir, schedule, positions, feeds)
+        print(f"Synthetic dataset written to {dataset_dir}")
+
+    results = [run_isolated(bench_feed_parsing, dataset_dir)]
+    results.extend(run_isolated(bench_map_matching, dataset_dir, args.valhalla_latency_ms))
+    if args.psql:
+        results.extend(run_isolated(bench_sql_importers, args.psql))
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+    print_report(results)
+
+    with open(args.output, "w") as f:
+        json.dump({"dataset": dataset_dir, "results": results}, f, indent=2)
+    print(f"Report saved to {args.output}")
@@ -0,0 +1,301 @@
+import argparse
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "gtfs_realtime"))
+from definitions import gtfs_realtime_pb2
+
+# Centro de Praga, usado como origen de la red sintetica
+CENTER_LAT = 50.087008
+CENTER_LON = 14.420917
+METERS_PER_DEG_LAT = 111320
+SHAPE_STEP_M = 50
+SERVICE_DATE = "2025-07-11"
+AGENCY_TIMEZONE = "Europe/Prague"
+ROUTE_TYPES = ["0", "1", "3"]
+
+
+def offset(lat, lon, dx, dy):
+    dlat = dy / METERS_PER_DEG_LAT
+    dlon = dx / (METERS_PER_DEG_LAT * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+
+def random_shape(rng, num_points):
+    """Smooth random walk starting near the center, as a list of (lat, lon)."""
+    lat, lon = offset(
+        CENTER_LAT, CENTER_LON, rng.uniform(-8000, 8000), rng.uniform(-6000, 6000)
+    )
+    heading = rng.uniform(0, 2 * math.pi)
+    points = [(lat, lon)]
+    for _ in range(num_points - 1):
+        heading += rng.gauss(0, 0.15)
+        lat, lon = offset(
+            lat, lon, SHAPE_STEP_M * math.cos(heading), SHAPE_STEP_M * math.sin(heading)
+        )
+        points.append((lat, lon))
+    return points
+
+
+def format_gtfs_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def generate_schedule(
+    seed=0, routes=20, trips_per_route=10, stops_per_route=25, shape_points_per_stop=8
+):
+    """
+    Builds a deterministic GTFS schedule. Returns a dict table name -> DataFrame
+    with the columns of the corresponding GTFS .txt file.
+    """
+    rng = random.Random(seed)
+    tables = {
+        name: []
+        for name in (
+            "agency",
+            "calendar",
+            "routes",
+            "shapes",
+            "stops",
+            "trips",
+            "stop_times",
+        )
+    }
+    tables["agency"].append(
+        {
+            "agency_id": "SYN",
+            "agency_name": "Synthetic",
+            "agency_url": "https://example.org",
+            "agency_timezone": AGENCY_TIMEZONE,
+        }
+    )
+    service_date = datetime.strptime(SERVICE_DATE, "%Y-%m-%d")
+    tables["calendar"].append(
+        {
+            "service_id": "all_days",
+            **{
+                day: 1
+                for day in (
+                    "monday",
+                    "tuesday",
+                    "wednesday",
+                    "thursday",
+                    "friday",
+                    "saturday",
+                    "sunday",
+                )
+            },
+            "start_date": service_date.strftime("%Y%m%d"),
+            "end_date": service_date.strftime("%Y%m%d"),
+        }
+    )
+
+    for r in range(routes):
+        route_id = f"L{r + 1}"
+        route_type = ROUTE_TYPES[r % len(ROUTE_TYPES)]
+        shape_id = f"S{r + 1}"
+        tables["routes"].append(
+            {
+                "route_id": route_id,
+                "agency_id": "SYN",
+                "route_short_name": str(r + 1),
+                "route_type": route_type,
+            }
+        )
+
+        shape = random_shape(rng, stops_per_route * shape_points_per_stop)
+        for seq, (lat, lon) in enumerate(shape, start=1):
+            tables["shapes"].append(
+                {
+                    "shape_id": shape_id,
+                    "shape_pt_lat": lat,
+                    "shape_pt_lon": lon,
+                    "shape_pt_sequence": seq,
+                    "shape_dist_traveled": (seq - 1) * SHAPE_STEP_M / 1000,
+                }
+            )
+
+        stop_ids = []
+        for s in range(stops_per_route):
+            idx = min(s * shape_points_per_stop, len(shape) - 1)
+            stop_id = f"{route_id}_U{s + 1}"
+            stop_ids.append((stop_id, idx))
+            lat, lon = shape[idx]
+            tables["stops"].append(
+                {
+                    "stop_id": stop_id,
+                    "stop_name": f"Stop {route_id} {s + 1}",
+                    "stop_lat": lat,
+                    "stop_lon": lon,
+                }
+            )
+
+        speed_ms = rng.uniform(5, 12)
+        for t in range(trips_per_route):
+            trip_id = f"{route_id}_T{t + 1}"
+            start = 5 * 3600 + t * rng.randint(300, 900) + r * 60
+            tables["trips"].append(
+                {
+                    "route_id": route_id,
+                    "service_id": "all_days",
+                    "trip_id": trip_id,
+                    "shape_id": shape_id,
+                    "direction_id": 0,
+                }
+            )
+            for seq, (stop_id, idx) in enumerate(stop_ids, start=1):
+                arrival = start + idx * SHAPE_STEP_M / speed_ms
+                tables["stop_times"].append(
+                    {
+                        "trip_id": trip_id,
+                        "arrival_time": format_gtfs_time(arrival),
+                        "departure_time": format_gtfs_time(arrival + 20),
+                        "stop_id": stop_id,
+                        "stop_sequence": seq,
+                        "shape_dist_traveled": idx * SHAPE_STEP_M / 1000,
+                    }
+                )
+
+    return {name: pd.DataFrame(rows) for name, rows in tables.items()}
+
+
+def interpolate_shape(shape, fraction):
+    position = fraction * (len(shape) - 1)
+    i = min(int(position), len(shape) - 2)
+    f = position - i
+    (lat1, lon1), (lat2, lon2) = shape[i], shape[i + 1]
+    return lat1 + (lat2 - lat1) * f, lon1 + (lon2 - lon1) * f
+
+
+def generate_vehicle_positions(
+    schedule, seed=0, poll_interval=20, noise_m=8, glitch_rate=0.002
+):
+    """
+    Simulates the positions reported every `poll_interval` seconds by the
+    vehicle of each trip, with GPS noise and occasional far-away glitches.
+    Returns a DataFrame in the format written by rest_gtfs_rt_inspector.py.
+    """
+    rng = random.Random(seed + 1)
+    shapes = {
+        shape_id: list(zip(group["shape_pt_lat"], group["shape_pt_lon"]))
+        for shape_id, group in schedule["shapes"].groupby("shape_id", sort=False)
+    }
+    stop_times = schedule["stop_times"].groupby("trip_id", sort=False)
+    # Los horarios GTFS son locales de la agencia; las posiciones se guardan en UTC
+    service_date = datetime.strptime(SERVICE_DATE, "%Y-%m-%d").replace(
+        tzinfo=ZoneInfo(AGENCY_TIMEZONE)
+    )
+
+    rows = []
+    for _, trip in schedule["trips"].iterrows():
+        times = stop_times.get_group(trip["trip_id"])["arrival_time"]
+        first, last = (
+            sum(int(x) * m for x, m in zip(t.split(":"), (3600, 60, 1)))
+            for t in (times.iloc[0], times.iloc[-1])
+        )
+        delay = rng.uniform(-60, 300)
+        shape = shapes[trip["shape_id"]]
+        vehicle_id = f"service-{trip['route_id']}-{trip['trip_id']}"
+        # Los vehiculos reportan en una grilla comun, como en cada consulta al feed
+        t = math.ceil((first + delay) / poll_interval) * poll_interval
+        while t <= last + delay:
+            fraction = (t - delay - first) / max(last - first, 1)
+            lat, lon = interpolate_shape(shape, fraction)
+            if rng.random() < glitch_rate:
+                lat, lon = offset(
+                    lat, lon, rng.uniform(-20000, 20000), rng.uniform(-20000, 20000)
+                )
+            else:
+                lat, lon = offset(lat, lon, rng.gauss(0, noise_m), rng.gauss(0, noise_m))
+            timestamp = (service_date + timedelta(seconds=t)).astimezone(timezone.utc)
+            rows.append(
+                {
+                    "longitude": lon,
+                    "latitude": lat,
+                    "timestamp": timestamp.replace(tzinfo=None).isoformat(),
+                    "route_id": trip["route_id"],
+                    "trip_id": trip["trip_id"],
+                    "vehicle_id": vehicle_id,
+                }
+            )
+            t += poll_interval
+    return pd.DataFrame(rows)
+
+
+def generate_feed_snapshots(positions):
+    """
+    Groups the simulated positions by timestamp into GTFS-RT FeedMessages,
+    one per poll, as served by the protobuf endpoint.
+    """
+    feeds = []
+    for timestamp, group in positions.groupby("timestamp", sort=True):
+        # timestamp es UTC sin zona, como lo escriben los extractores
+        epoch = int(
+            datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+        )
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "2.0"
+        feed.header.timestamp = epoch
+        for row in group.itertuples(index=False):
+            entity = feed.entity.add()
+            entity.id = row.vehicle_id
+            vehicle = entity.vehicle
+            vehicle.trip.trip_id = row.trip_id
+            vehicle.trip.route_id = row.route_id
+            vehicle.trip.start_date = SERVICE_DATE.replace("-", "")
+            vehicle.vehicle.id = row.vehicle_id
+            vehicle.position.latitude = row.latitude
+            vehicle.position.longitude = row.longitude
+            vehicle.timestamp = epoch
+        feeds.append(feed)
+    return feeds
+
+
+def write_dataset(output_dir, schedule, positions, feeds):
+    gtfs_dir = os.path.join(output_dir, "gtfs")
+    pb_dir = os.path.join(output_dir, "realtime")
+    os.makedirs(gtfs_dir, exist_ok=True)
+    os.makedirs(pb_dir, exist_ok=True)
+    for name, df in schedule.items():
+        df.to_csv(os.path.join(gtfs_dir, f"{name}.txt"), index=False)
+    positions.to_parquet(os.path.join(output_dir, "vehicle_positions.parquet"), index=False)
+    for feed in feeds:
+        with open(os.path.join(pb_dir, f"{feed.header.timestamp}.pb"), "wb") as f:
+            f.write(feed.SerializeToString())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a deterministic synthetic GTFS / GTFS-RT dataset."
+    )
+    parser.add_argument("output_dir", help="Directory where the dataset is written")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--trips-per-route", type=int, default=10)
+    parser.add_argument("--stops-per-route", type=int, default=25)
+    parser.add_argument("--poll-interval", type=int, default=20)
+    args = parser.parse_args()
+
+    schedule = generate_schedule(
+        seed=args.seed,
+        routes=args.routes,
+        trips_per_route=args.trips_per_route,
+        stops_per_route=args.stops_per_route,
+    )
+    positions = generate_vehicle_positions(
+        schedule, seed=args.seed, poll_interval=args.poll_interval
+    )
+    feeds = generate_feed_snapshots(positions)
+    write_dataset(args.output_dir, schedule, positions, feeds)
+
+    print(f"Trips: {len(schedule['trips'])}")
+    print(f"Stop times: {len(schedule['stop_times'])}")
+    print(f"Vehicle positions: {len(positions)}")
+    print(f"Feed snapshots: {len(feeds)}")
@@ -3,6 +3,7 @@ import psycopg2
 from psycopg2 import sql
 import json
 from collections import defaultdict
+from schedule_store import ScheduleStore
 
 # Database configuration
 DB_CONFIG = {
@@ -56,16 +57,29 @@ def get_route_types_from_db(trip_ids):
         print(f"Database error: {e}")
         return {}
 
-def analyze_vehicles(geojson_path):
-    """Analyze vehicles with route types from database"""
+def get_route_types_from_store(trip_ids, store_dir):
+    """Route types for a list of trip_ids from a schedule store built by schedule_store.py"""
+    store = ScheduleStore(store_dir)
+    return {
+        trip_id: route_type
+        for trip_id, route_type in zip(trip_ids, store.trip_route_types(trip_ids))
+        if route_type is not None
+    }
+
+def analyze_vehicles(geojson_path, store_dir=None):
+    """Analyze vehicles with route types from database (or from a schedule store)"""
     gdf = gpd.read_file(geojson_path)
 
     gdf = gdf.sort_values('trip_id').drop_duplicates('trip_id', keep='first')
 
     trip_ids = gdf['trip_id'].unique().tolist()
 
-    print("Fetching route types from database...")
-    route_types = get_route_types_from_db(trip_ids)
+    if store_dir:
+        print("Fetching route types from schedule store...")
+        route_types = get_route_types_from_store(trip_ids, store_dir)
+    else:
+        print("Fetching route types from database...")
+        route_types = get_route_types_from_db(trip_ids)
     
     gdf['route_type'] = gdf['trip_id'].map(route_types)
     gdf['route_type_name'] = gdf['route_type'].map(GTFS_ROUTE_TYPES)
@@ -95,14 +109,15 @@ def analyze_vehicles(geojson_path):
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) != 2:
-        print("Usage: python analyze_vehicles.py map_matching_errors.geojson")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python analyze_vehicles.py map_matching_errors.geojson [schedule_store_dir]")
         sys.exit(1)
     
     geojson_path = sys.argv[1]
+    store_dir = sys.argv[2] if len(sys.argv) == 3 else None
     
     try:
-        results, vehicle_gdf = analyze_vehicles(geojson_path)
+        results, vehicle_gdf = analyze_vehicles(geojson_path, store_dir)
         
         print("\nVehicle Counts by Route Type:")
 
@@ -5,6 +5,8 @@ import pandas as pd
 import urllib.request as urllib
 from google.protobuf.json_format import MessageToDict
 from definitions import gtfs_realtime_pb2
+from pb_archive import SegmentWriter
+from poll_scheduler import AdaptivePoller, header_timestamp, last_modified
 import pyarrow.parquet as pq
 import pyarrow as pa
 from datetime import datetime, timedelta
@@ -13,15 +15,38 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def fetch_gtfs_feed(server_url_prefix, feed_name):
-    url = f'https://{server_url_prefix}/v2/vehiclepositions/gtfsrt/{feed_name}.pb'
+def fetch_gtfs_feed_response(server_url_prefix, feed_name):
+    """Raw feed bytes and response headers, or (None, None) on error."""
+    # Se admite un prefijo con esquema (p.ej. http://127.0.0.1:8080 para replay_server.py)
+    if '://' not in server_url_prefix:
+        server_url_prefix = f'https://{server_url_prefix}'
+    url = f'{server_url_prefix}/v2/vehiclepositions/gtfsrt/{feed_name}.pb'
     try:
         response = urllib.urlopen(url)
+        return response.read(), response.headers
+    except Exception as e:
+        logging.error(f"Error fetching feed: {e}")
+        return None, None
+
+
+def fetch_gtfs_feed_raw(server_url_prefix, feed_name):
+    return fetch_gtfs_feed_response(server_url_prefix, feed_name)[0]
+
+
+def fetch_gtfs_feed(server_url_prefix, feed_name):
+    raw = fetch_gtfs_feed_raw(server_url_prefix, feed_name)
+    if raw is None:
+        return None
+    return parse_gtfs_feed(raw)
+
+
+def parse_gtfs_feed(raw):
+    try:
         feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.read())
+        feed.ParseFromString(raw)
         return feed
     except Exception as e:
-        logging.error(f"Error fetching feed: {e}")
+        logging.error(f"Error parsing feed: {e}")
         return None
 
 
@@ -29,22 +54,69 @@ def extract_vehicle_positions(feed):
     return [MessageToDict(entity) for entity in feed.entity]
 
 
+def poll_gtfs_feed_raw(poller, server_url_prefix, feed_name):
+    """
+    Waits for the poller's next slot and fetches the feed. Returns the raw
+    bytes and the fetch time, with raw None when the fetch failed or the
+    snapshot was already seen.
+    """
+    started = poller.wait()
+    raw, headers = fetch_gtfs_feed_response(server_url_prefix, feed_name)
+    finished = time.time()
+    publish_time = None
+    if not raw:
+        logging.warning("No data fetched.")
+        raw = None
+    else:
+        try:
+            publish_time = header_timestamp(raw)
+        except Exception as e:
+            logging.error(f"Error parsing feed header: {e}")
+        if publish_time is None:
+            publish_time = last_modified(headers)
+    is_new = poller.record(started, finished, publish_time, raw)
+    return (raw if is_new else None), finished
+
+
+def archive_vehicle_positions(server_url_prefix, feed_name, duration_minutes, interval_seconds, archive_dir):
+    """Stores every raw snapshot in the segment archive without decoding it."""
+    writer = SegmentWriter(archive_dir, feed_name)
+    poller = AdaptivePoller(feed_name, default_interval=interval_seconds)
+    end_time = time.time() + duration_minutes * 60
+    next_report_time = time.time() + 300
+    snapshots = 0
+    try:
+        while time.time() < end_time:
+            raw, fetch_time = poll_gtfs_feed_raw(poller, server_url_prefix, feed_name)
+            if raw:
+                writer.append(raw, fetch_time)
+                snapshots += 1
+            if time.time() >= next_report_time:
+                poller.log_metrics()
+                next_report_time += 300
+    finally:
+        writer.close()
+    logging.info(f"{snapshots} snapshots archived to {archive_dir}")
+    poller.log_metrics()
+
+
 def collect_vehicle_positions(server_url_prefix, feed_name, duration_minutes, interval_seconds):
     collected_data = []
+    poller = AdaptivePoller(feed_name, default_interval=interval_seconds)
     start_time = time.time()
     end_time = start_time + duration_minutes * 60
     next_save_time = start_time + 300  # 5 minutes
 
     while time.time() < end_time:
-        feed = fetch_gtfs_feed(server_url_prefix, feed_name)
+        # Solo se guardan snapshots nuevos; los repetidos los descarta el poller
+        raw, fetch_time = poll_gtfs_feed_raw(poller, server_url_prefix, feed_name)
+        feed = parse_gtfs_feed(raw) if raw else None
         if feed:
             positions = extract_vehicle_positions(feed)
-            timestamp = datetime.utcnow().isoformat()
+            timestamp = datetime.utcfromtimestamp(fetch_time).isoformat()
             for pos in positions:
                 pos["fetch_time"] = timestamp
             collected_data.extend(positions)
-        else:
-            logging.warning("No data fetched.")
 
         # Save every 5 minutes
         if time.time() >= next_save_time:
@@ -61,10 +133,10 @@ def collect_vehicle_positions(server_url_prefix, feed_name, duration_minutes, in
                 logging.info(f"Partial data saved to {fname}")
             else:
                 logging.info("No data collected yet to save.")
+            poller.log_metrics()
             next_save_time += 300  # next 5-minute mark
 
-        time.sleep(interval_seconds)
-
+    poller.log_metrics()
     return pd.DataFrame(collected_data)
 
 
@@ -78,19 +150,26 @@ def save_to_parquet(df, file_name):
 
 if __name__ == "__main__":
     if len(sys.argv) < 4:
-        logging.error("Usage: python gtfs_rt_inspector.py <server_url_prefix> <feed_name> <duration_minutes>")
+        logging.error("Usage: python gtfs_rt_inspector.py <server_url_prefix> <feed_name> <duration_minutes> [archive_dir]")
         sys.exit(1)
 
     server_url_prefix = sys.argv[1]
     feed_name = sys.argv[2]
     duration_minutes = int(sys.argv[3])
-    interval_seconds = 20  # Still hardcoded, but configurable if desired
+    archive_dir = sys.argv[4] if len(sys.argv) > 4 else None
+    # Intervalo inicial; el poller lo reemplaza por la cadencia aprendida del feed
+    interval_seconds = 20
 
     logging.info(f"Starting data collection from feed '{feed_name}' for {duration_minutes} minutes...")
     logging.info(f"Current time: {datetime.utcnow().isoformat()}")
-    logging.info(f"Data will be collected every {interval_seconds} seconds.")
+    logging.info(f"Data will be collected every {interval_seconds} seconds until the feed cadence is learned.")
     logging.info(f"Expected end time: {datetime.utcnow() + timedelta(minutes=duration_minutes)}")
 
+    if archive_dir:
+        # Modo archivo: se guardan los bytes crudos y se decodifican luego con pb_archive.py
+        archive_vehicle_positions(server_url_prefix, feed_name, duration_minutes, interval_seconds, archive_dir)
+        sys.exit(0)
+
     df = collect_vehicle_positions(server_url_prefix, feed_name, duration_minutes, interval_seconds)
 
     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
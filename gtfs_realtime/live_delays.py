@@ -0,0 +1,345 @@
+import argparse
+import glob
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import Transformer
+
+from definitions import gtfs_realtime_pb2
+from gtfs_rt_inspector import parse_gtfs_feed, poll_gtfs_feed_raw
+from poll_scheduler import AdaptivePoller
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Database configuration
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "prague",
+    "user": "postgres",
+    "port": "25432",
+}
+
+# Distancia (m) a la parada para considerar que el vehiculo paso por ella
+PASSAGE_RADIUS = 30
+# Cantidad de paradas siguientes que se revisan en cada posicion
+LOOKAHEAD_STOPS = 3
+POLL_INTERVAL = 20
+
+to_metric = Transformer.from_crs("EPSG:4326", "EPSG:5514", always_xy=True)
+
+SCHEDULE_QUERY = """
+SELECT ad.trip_id,
+       ad.stop_sequence,
+       ad.stop_id,
+       EXTRACT(EPOCH FROM ad.t_arrival) AS scheduled,
+       ST_X(ST_Transform(s.stop_loc::geometry, 5514)) AS x,
+       ST_Y(ST_Transform(s.stop_loc::geometry, 5514)) AS y
+FROM arrivals_departures ad
+JOIN stops s ON s.stop_id = ad.stop_id
+WHERE ad.date = %s
+ORDER BY ad.trip_id, ad.stop_sequence;
+"""
+
+
+class Schedule:
+    """
+    Stop sequences of every trip of a service date in CSR layout: the stops of
+    trip i are rows offsets[i]:offsets[i + 1] of the flat per-stop arrays.
+    """
+
+    def __init__(self, stops):
+        stops = stops.sort_values(["trip_id", "stop_sequence"]).reset_index(drop=True)
+        trip_ids, starts = np.unique(stops["trip_id"].to_numpy(), return_index=True)
+        self.trip_ids = trip_ids
+        self.trip_index = {trip_id: i for i, trip_id in enumerate(trip_ids)}
+        self.offsets = np.append(starts, len(stops)).astype(np.int64)
+
+        self.stop_ids, self.stop_code = np.unique(
+            stops["stop_id"].to_numpy(), return_inverse=True
+        )
+        self.stop_code = self.stop_code.astype(np.int32)
+        self.stop_sequence = stops["stop_sequence"].to_numpy(dtype=np.int32)
+        self.scheduled = stops["scheduled"].to_numpy(dtype=np.float64)
+        self.x = stops["x"].to_numpy(dtype=np.float64)
+        self.y = stops["y"].to_numpy(dtype=np.float64)
+
+
+def load_schedule(service_date):
+    conn = psycopg2.connect(**DB_CONFIG)
+    stops = pd.read_sql_query(SCHEDULE_QUERY, conn, params=(service_date,))
+    conn.close()
+    return Schedule(stops)
+
+
+def closest_approach(x0, y0, x1, y1, sx, sy):
+    """
+    Fraction along each segment (x0, y0) -> (x1, y1) closest to the stop
+    (sx, sy), and the distance at that point. Works elementwise on arrays.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(length2 > 0, ((sx - x0) * dx + (sy - y0) * dy) / length2, 1.0)
+    frac = np.clip(frac, 0.0, 1.0)
+    dist = np.hypot(x0 + frac * dx - sx, y0 + frac * dy - sy)
+    return frac, dist
+
+
+class LiveDelayEngine:
+    """
+    Keeps the state of every active trip (next expected stop and last
+    position) in flat arrays and turns each feed snapshot into stop passages
+    with their delay against the schedule.
+    """
+
+    def __init__(self, schedule, radius=PASSAGE_RADIUS, lookahead=LOOKAHEAD_STOPS):
+        self.schedule = schedule
+        self.radius = radius
+        self.lookahead = lookahead
+        n = len(schedule.trip_ids)
+        self.next_stop = schedule.offsets[:-1].copy()
+        self.last_x = np.full(n, np.nan)
+        self.last_y = np.full(n, np.nan)
+        self.last_t = np.full(n, np.nan)
+
+    def parse_feed(self, feed):
+        """Reads only the fields needed from the feed, skipping unknown trips."""
+        trips, lon, lat, ts = [], [], [], []
+        header_ts = feed.header.timestamp
+        for entity in feed.entity:
+            if not entity.HasField("vehicle"):
+                continue
+            vehicle = entity.vehicle
+            trip = self.schedule.trip_index.get(vehicle.trip.trip_id)
+            if trip is None or not vehicle.HasField("position"):
+                continue
+            trips.append(trip)
+            lon.append(vehicle.position.longitude)
+            lat.append(vehicle.position.latitude)
+            ts.append(vehicle.timestamp or header_ts)
+        x, y = to_metric.transform(np.array(lon), np.array(lat))
+        return (
+            np.array(trips, dtype=np.int64),
+            np.asarray(x, dtype=np.float64),
+            np.asarray(y, dtype=np.float64),
+            np.array(ts, dtype=np.float64),
+        )
+
+    def process(self, trips, x, y, t):
+        """
+        Advances the trips with the given positions and returns the detected
+        stop passages as a list of dicts.
+        """
+        s = self.schedule
+        fresh = ~(t <= self.last_t[trips])
+        trips, x, y, t = trips[fresh], x[fresh], y[fresh], t[fresh]
+        first = np.isnan(self.last_t[trips])
+
+        # La primera posicion de un trip se trata como un segmento de largo cero
+        x0 = np.where(np.isnan(self.last_x[trips]), x, self.last_x[trips])
+        y0 = np.where(np.isnan(self.last_y[trips]), y, self.last_y[trips])
+        t0 = np.where(np.isnan(self.last_t[trips]), t, self.last_t[trips])
+
+        # Chequeo vectorizado de las proximas paradas de todos los vehiculos
+        end = s.offsets[trips + 1]
+        candidates = self.next_stop[trips][:, None] + np.arange(self.lookahead)
+        valid = candidates < end[:, None]
+        candidates = np.minimum(candidates, end[:, None] - 1)
+        frac, dist = closest_approach(
+            x0[:, None], y0[:, None], x[:, None], y[:, None],
+            s.x[candidates], s.y[candidates],
+        )
+        # Mientras el vehiculo se sigue acercando (frac == 1) la pasada se
+        # posterga a la proxima posicion, salvo en la ultima parada del trip
+        is_last = candidates == end[:, None] - 1
+        hit = valid & (dist <= self.radius) & ((frac < 1) | is_last)
+
+        passages = []
+        for v in np.flatnonzero(hit.any(axis=1)):
+            trip = trips[v]
+            stop = candidates[v, hit[v].argmax()]
+            while stop < end[v]:
+                frac, d = closest_approach(x0[v], y0[v], x[v], y[v], s.x[stop], s.y[stop])
+                if d > self.radius or (frac >= 1 and stop < end[v] - 1):
+                    break
+                actual = t0[v] + float(frac) * (t[v] - t0[v])
+                passages.append(
+                    {
+                        "trip_id": s.trip_ids[trip],
+                        "stop_id": s.stop_ids[s.stop_code[stop]],
+                        "stop_sequence": int(s.stop_sequence[stop]),
+                        "scheduled_time": s.scheduled[stop],
+                        "actual_time": actual,
+                        "delay_seconds": actual - s.scheduled[stop],
+                    }
+                )
+                stop += 1
+            self.next_stop[trip] = stop
+
+        # Trips que empiezan a verse a mitad de recorrido, o que saltearon paradas
+        # durante un hueco de posiciones: se reubican en la secuencia de paradas
+        lost = first | ~hit.any(axis=1) & ~self.near_expected(trips, x, y)
+        for v in np.flatnonzero(lost):
+            self.resync(trips[v], x[v], y[v], backwards=first[v])
+
+        self.last_x[trips] = x
+        self.last_y[trips] = y
+        self.last_t[trips] = t
+        return passages
+
+    def near_expected(self, trips, x, y):
+        """
+        Whether each vehicle is within the radius of the stretch between the
+        last passed stop and its next expected stop.
+        """
+        s = self.schedule
+        start, end = s.offsets[trips], s.offsets[trips + 1]
+        nxt = np.minimum(self.next_stop[trips], end - 1)
+        prev = np.maximum(nxt - 1, start)
+        _, dist = closest_approach(s.x[prev], s.y[prev], s.x[nxt], s.y[nxt], x, y)
+        return (dist <= self.radius) | (self.next_stop[trips] >= end)
+
+    def resync(self, trip, x, y, backwards=False):
+        """
+        Moves the next expected stop of `trip` to the first stop ahead of the
+        vehicle, locating it on the nearest stretch between consecutive stops.
+        Unless `backwards`, the trip never moves behind its current stop.
+        """
+        s = self.schedule
+        start, end = s.offsets[trip], s.offsets[trip + 1]
+        lo = start if backwards else max(self.next_stop[trip] - 1, start)
+        if end - lo < 2:
+            return
+        a = np.arange(lo, end - 1)
+        _, dist = closest_approach(s.x[a], s.y[a], s.x[a + 1], s.y[a + 1], x, y)
+        # En recorridos con ida y vuelta se elige el primer tramo cercano, no el minimo exacto
+        k = np.flatnonzero(dist <= dist.min() + self.radius)[0]
+        at_stop = np.hypot(s.x[a[k]] - x, s.y[a[k]] - y) <= self.radius
+        stop = a[k] if at_stop else a[k] + 1
+        if backwards or stop > self.next_stop[trip]:
+            self.next_stop[trip] = stop
+
+    def process_feed(self, feed):
+        return self.process(*self.parse_feed(feed))
+
+
+class ParquetSink:
+    """Buffers passages and appends them to a Parquet file in row groups."""
+
+    def __init__(self, path, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = []
+        self.writer = None
+
+    def write(self, passages):
+        self.buffer.extend(passages)
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        table = pa.Table.from_pandas(pd.DataFrame(self.buffer), preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class QueueSink:
+    """Puts each passage on a queue.Queue for an in-process consumer."""
+
+    def __init__(self, out_queue):
+        self.queue = out_queue
+
+    def write(self, passages):
+        for passage in passages:
+            self.queue.put(passage)
+
+    def close(self):
+        pass
+
+
+def replay_feeds(directory):
+    """Yields the FeedMessages saved as .pb files in `directory`, in name order."""
+    for path in sorted(glob.glob(os.path.join(directory, "*.pb"))):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        with open(path, "rb") as f:
+            feed.ParseFromString(f.read())
+        yield feed
+
+
+def live_feeds(server_url_prefix, feed_name, interval_seconds=POLL_INTERVAL):
+    # El poller se alinea con la publicacion del feed y descarta los snapshots repetidos
+    poller = AdaptivePoller(feed_name, default_interval=interval_seconds)
+    try:
+        while True:
+            raw, _ = poll_gtfs_feed_raw(poller, server_url_prefix, feed_name)
+            feed = parse_gtfs_feed(raw) if raw else None
+            if feed:
+                yield feed
+    finally:
+        poller.log_metrics()
+
+
+def run(engine, feeds, sink):
+    total = 0
+    try:
+        for feed in feeds:
+            start = time.perf_counter()
+            passages = engine.process_feed(feed)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            sink.write(passages)
+            total += len(passages)
+            logging.info(
+                f"{len(feed.entity)} vehicles, {len(passages)} stop passages in {elapsed_ms:.1f} ms"
+            )
+    except KeyboardInterrupt:
+        logging.info("Interrupted.")
+    finally:
+        sink.close()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute per-stop delays in real time from GTFS-RT vehicle positions."
+    )
+    parser.add_argument("service_date", help="Service date of the schedule, e.g. 2025-07-11")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", help="Directory with recorded .pb snapshots to replay")
+    source.add_argument(
+        "--live",
+        nargs=2,
+        metavar=("SERVER_URL_PREFIX", "FEED_NAME"),
+        help="Poll the live feed, e.g. api.golemio.cz vehicle_positions",
+    )
+    parser.add_argument("--radius", type=float, default=PASSAGE_RADIUS)
+    parser.add_argument(
+        "--output",
+        default=f"live_delays_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.parquet",
+    )
+    args = parser.parse_args()
+
+    logging.info(f"Loading schedule for {args.service_date}...")
+    schedule = load_schedule(args.service_date)
+    logging.info(f"{len(schedule.trip_ids)} trips, {len(schedule.scheduled)} stop times loaded.")
+
+    engine = LiveDelayEngine(schedule, radius=args.radius)
+    feeds = replay_feeds(args.replay) if args.replay else live_feeds(*args.live)
+    total = run(engine, feeds, ParquetSink(args.output))
+    logging.info(f"{total} stop passages saved to {args.output}")
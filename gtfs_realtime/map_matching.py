@@ -1,14 +1,22 @@
-from unittest import result
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import requests
-from polyline import decode
-from shapely.geometry import LineString, Point
+from shapely.geometry import Point
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import tqdm
-import json
 from pyproj import Geod
 import argparse
+from schedule_store import ScheduleStore
+from shape_matching import load_trip_shapes, snap_to_shape
+from postprocess import (
+    POSTPROCESS_BATCH_SIZE,
+    POSTPROCESS_WORKERS,
+    build_trip_outputs,
+    ipc_to_table,
+)
 
 geod = Geod(ellps="WGS84")
 
@@ -16,19 +24,130 @@ VALHALLA_URL = "http://localhost:8002/trace_route"
 # VALHALLA_URL = "http://localhost:8002/trace_attributes"
 # VALHALLA_URL = "https://valhalla1.openstreetmap.de/trace_route"
 
+# Trazas largas se dividen en ventanas solapadas que se matchean por separado
+MAX_TRACE_POINTS = 200
+TRACE_OVERLAP = 10
+MAX_PARALLEL_WINDOWS = 4
+# Radios de busqueda (m) usados al reintentar una ventana que falla
+SEARCH_RADII = (100, 200, 400)
+
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     _, _, dist = geod.inv(lon1, lat1, lon2, lat2)
     return dist  # en metros
 
 
-discarded_points = 0
+# Cantidad de puntos descartados por motivo (fuera del area, outlier de velocidad, etc.)
+discarded_points = defaultdict(int)
 MAX_DISTANCE_BETWEEN_POINTS = 2000
+MAX_SPEED_KMH = 150
+PREFILTER_CHUNK_SIZE = 200_000
+
+
+def load_service_area(path):
+    """
+    Loads the service area polygon (e.g. the `province` boundary exported to
+    GeoJSON) and returns it as a single prepared geometry in EPSG:4326.
+    """
+    area = gpd.read_file(path)
+    if area.crs is not None:
+        area = area.to_crs("EPSG:4326")
+    geom = shapely.unary_union(area.geometry.values)
+    shapely.prepare(geom)
+    return geom
+
+
+def timestamps_to_seconds(series):
+    """Converts epoch or ISO timestamps to float epoch seconds."""
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().all():
+        return numeric.astype(float).to_numpy()
+    parsed = pd.to_datetime(series, utc=True, errors="coerce")
+    return (parsed - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy()
+
+
+def outside_service_area_mask(gdf, service_area, chunk_size=PREFILTER_CHUNK_SIZE):
+    lon = gdf["longitude"].to_numpy(dtype=float)
+    lat = gdf["latitude"].to_numpy(dtype=float)
+    inside = np.zeros(len(gdf), dtype=bool)
+    # Se procesa por bloques para no materializar todos los puntos a la vez
+    for start in range(0, len(gdf), chunk_size):
+        end = start + chunk_size
+        inside[start:end] = shapely.contains_xy(service_area, lon[start:end], lat[start:end])
+    return ~inside
+
+
+def speed_outlier_mask(gdf, max_speed_kmh=MAX_SPEED_KMH):
+    """
+    Flags isolated GPS glitches: points whose implied speed from the previous
+    point and to the next point of the same trip both exceed `max_speed_kmh`.
+    The first and last points of a trip only have one neighbour; they are
+    flagged when that jump is too fast and the neighbour is not a glitch itself.
+    Expects `gdf` sorted by vehicle, trip and timestamp.
+    """
+    keys = ["vehicle_id", "trip_id"]
+    lon = gdf["longitude"].to_numpy(dtype=float)
+    lat = gdf["latitude"].to_numpy(dtype=float)
+    secs = timestamps_to_seconds(gdf["timestamp"])
+
+    same_as_prev = np.zeros(len(gdf), dtype=bool)
+    if len(gdf) > 1:
+        same_as_prev[1:] = np.logical_and.reduce(
+            [gdf[k].to_numpy()[1:] == gdf[k].to_numpy()[:-1] for k in keys]
+        )
 
+    speed_in = np.full(len(gdf), np.nan)
+    if len(gdf) > 1:
+        _, _, dist = geod.inv(lon[:-1], lat[:-1], lon[1:], lat[1:])
+        dt = secs[1:] - secs[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.where(dt > 0, np.asarray(dist) / dt * 3.6, np.nan)
+        speed_in[1:] = np.where(same_as_prev[1:], speed, np.nan)
+
+    speed_out = np.full(len(gdf), np.nan)
+    speed_out[:-1] = speed_in[1:]
+
+    fast_in = speed_in > max_speed_kmh
+    fast_out = speed_out > max_speed_kmh
+    has_in = ~np.isnan(speed_in)
+    has_out = ~np.isnan(speed_out)
+
+    # Estado del vecino anterior / siguiente, para no descartar un extremo valido junto a un glitch
+    prev_fast_in = np.zeros(len(gdf), dtype=bool)
+    prev_fast_in[1:] = fast_in[:-1]
+    next_fast_out = np.zeros(len(gdf), dtype=bool)
+    next_fast_out[:-1] = fast_out[1:]
+    next_has_out = np.zeros(len(gdf), dtype=bool)
+    next_has_out[:-1] = has_out[1:]
+
+    middle = fast_in & fast_out
+    last = fast_in & ~has_out & ~prev_fast_in
+    first = fast_out & ~has_in & next_has_out & ~next_fast_out
+    return middle | last | first
+
+
+def prefilter_points(gdf, service_area=None, max_speed_kmh=MAX_SPEED_KMH):
+    """
+    Drops points that Valhalla cannot match before any request is sent:
+    positions outside the service area and speed-based GPS outliers.
+    Discards are recorded per reason in `discarded_points`.
+    """
+    gdf = gdf.sort_values(["vehicle_id", "trip_id", "timestamp"]).reset_index(drop=True)
+
+    if service_area is not None:
+        outside = outside_service_area_mask(gdf, service_area)
+        discarded_points["outside_service_area"] += int(outside.sum())
+        gdf = gdf[~outside].reset_index(drop=True)
+
+    if max_speed_kmh is not None and len(gdf) > 0:
+        outliers = speed_outlier_mask(gdf, max_speed_kmh)
+        discarded_points["speed_outlier"] += int(outliers.sum())
+        gdf = gdf[~outliers].reset_index(drop=True)
+
+    return gdf
 
-def prepare_trips(gdf):
-    global discarded_points
 
+def prepare_trips(gdf):
     gdf = gdf.sort_values(["vehicle_id", "trip_id", "timestamp"])
     trip_points = defaultdict(list)
     for _, row in gdf.iterrows():
@@ -50,7 +169,7 @@ def prepare_trips(gdf):
             )
             if dist >= MAX_DISTANCE_BETWEEN_POINTS:
                 # print(f"Discarded point: too far ({dist:.2f} m) from previous for trip {key}")
-                discarded_points += 1
+                discarded_points["max_distance"] += 1
                 continue  # Skip points too far away
 
         point = {
@@ -77,7 +196,114 @@ def append_error(
     )
 
 
+def split_trace(points, max_points=MAX_TRACE_POINTS, overlap=TRACE_OVERLAP):
+    """
+    Splits a trace into overlapping windows of at most `max_points` points.
+    Window sizes are balanced so the last window is not left with a few points.
+    Returns a list of (start, end) index pairs.
+    """
+    n = len(points)
+    if n <= max_points:
+        return [(0, n)]
+    step = max_points - overlap
+    num_windows = -(-(n - overlap) // step)
+    size = -(-(n - overlap) // num_windows) + overlap
+    windows = []
+    start = 0
+    while True:
+        end = min(start + size, n)
+        windows.append((start, end))
+        if end == n:
+            return windows
+        start = end - overlap
+
+
+def trace_route(points, search_radius):
+    payload = {
+        "shape": points,
+        "costing": "auto",
+        "shape_match": "map_snap",
+        "use_timestamps": True,
+        "format": "osrm",
+        "trace_options": {
+            "search_radius": search_radius,
+        },
+    }
+    headers = {"Content-Type": "application/json"}
+    response = requests.post(VALHALLA_URL, headers=headers, json=payload)
+    response.raise_for_status()
+    data = response.json()
+    return data["tracepoints"], data["matchings"][0].get("geometry")
+
+
+def match_window(points, search_radii=SEARCH_RADII):
+    """
+    Map matches a single window, retrying with a larger search radius when
+    Valhalla rejects the trace or leaves a tracepoint unmatched.
+    Returns (tracepoints, shape, index of the first unmatched point or None).
+    """
+    for attempt, radius in enumerate(search_radii):
+        last_attempt = attempt == len(search_radii) - 1
+        try:
+            trace_points, shape = trace_route(points, radius)
+        except requests.exceptions.HTTPError:
+            if last_attempt:
+                raise
+            continue
+        missing = next((i for i, tp in enumerate(trace_points) if tp is None), None)
+        if missing is None or last_attempt:
+            return trace_points, shape, missing
+
+
+def stitch_windows(points, windows, results):
+    """
+    Joins the per-window matches into a single trajectory. Each point in an
+    overlap is taken from the window where it lies furthest from the border.
+    The geometry is returned as shape pieces (see postprocess.join_shape_pieces)
+    cut at those points, so decoding can happen in the post-processing workers.
+    """
+    result_points = []
+    pieces = []
+    for k, ((start, end), (trace_points, shape_encoded, _)) in enumerate(
+        zip(windows, results)
+    ):
+        is_first = k == 0
+        is_last = k == len(windows) - 1
+        own_start = start if is_first else (start + windows[k - 1][1]) // 2
+        own_end = end if is_last else (windows[k + 1][0] + end) // 2
+
+        for i in range(own_start, own_end):
+            tp = trace_points[i - start]
+            result_points.append((tp["location"][0], tp["location"][1], points[i]["time"]))
+
+        cut_start = None
+        cut_end = None
+        if not is_first:
+            cut_start = tuple(trace_points[own_start - start]["location"])
+        if not is_last:
+            cut_end = tuple(trace_points[min(own_end, end - 1) - start]["location"])
+        pieces.append((shape_encoded, cut_start, cut_end))
+    return result_points, pieces
+
+
+def matched_runs(windows, results):
+    """Groups consecutive windows that were matched, splitting at the failed ones."""
+    runs = [[]]
+    for window, result in zip(windows, results):
+        if result is None:
+            if runs[-1]:
+                runs.append([])
+        else:
+            runs[-1].append((window, result))
+    return [run for run in runs if run]
+
+
 def map_match_trip(points, failed_log, vehicle_id=None, trip_id=None, route_id=None):
+    """
+    Map matches a trip window by window. Windows that still fail after every
+    search radius are logged and left out, splitting the trajectory there.
+    Returns a list of (matched, shape pieces) parts, empty if nothing matched.
+    """
     if len(points) < 2:
         append_error(
             failed_log,
@@ -88,106 +314,127 @@ def map_match_trip(points, failed_log, vehicle_id=None, trip_id=None, route_id=N
             "Less than 2 points for map matching",
             points,
         )
-        return None, None
+        return []
 
-    payload = {
-        "shape": points,
-        "costing": "auto",
-        "shape_match": "map_snap",
-        "use_timestamps": True,
-        "format": "osrm",
-        "trace_options": {
-            "search_radius": 100,
-        },
-    }
+    windows = split_trace(points)
 
-    try:
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(VALHALLA_URL, headers=headers, json=payload)
-
-        response.raise_for_status()
-        data = response.json()
-        shape_encoded = data["matchings"][0].get("geometry")
-        trace_points = data["tracepoints"]
-        result_points = []
-        for i, tp in enumerate(trace_points):
-            if tp is not None:
-                result_points.append(
-                    (tp["location"][0], tp["location"][1], points[i]["time"])
-                )
-            else:
-                print(
-                    f"Warning: Tracepoint {i} is None for trip {trip_id} and vehicle {vehicle_id}"
-                )
-                append_error(
-                    failed_log,
-                    vehicle_id,
-                    trip_id,
-                    route_id,
-                    "TracepointNone",
-                    f"Tracepoint {i} is None",
-                    points,
-                )
-                return None, None
+    def match(window):
+        try:
+            return match_window(points[window[0] : window[1]]), None
+        except requests.exceptions.HTTPError as e:
+            return None, e
 
-        return result_points, decode(shape_encoded, precision=6)
-    except requests.exceptions.HTTPError as e:
-        print(f"Error HTTP {e.response.status_code}: {e.response.text}")
-        append_error(
-            failed_log, vehicle_id, trip_id, route_id, "HTTPError", str(e), points
-        )
+    try:
+        # Las ventanas de un trip largo se matchean en paralelo
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_WINDOWS) as executor:
+            outcomes = list(executor.map(match, windows))
     except Exception as e:
         print(f"Error: {e}")
-    return None, None
+        return []
+
+    # Solo se descartan las ventanas que fallan; el resto del trip se conserva
+    results = []
+    for (start, end), (result, error) in zip(windows, outcomes):
+        window_points = points[start:end]
+        if error is not None:
+            print(f"Error HTTP {error.response.status_code}: {error.response.text}")
+            append_error(
+                failed_log, vehicle_id, trip_id, route_id, "HTTPError", str(error), window_points
+            )
+            result = None
+        elif result[2] is not None:
+            i = start + result[2]
+            print(
+                f"Warning: Tracepoint {i} is None for trip {trip_id} and vehicle {vehicle_id}"
+            )
+            append_error(
+                failed_log,
+                vehicle_id,
+                trip_id,
+                route_id,
+                "TracepointNone",
+                f"Tracepoint {i} is None (window {start}-{end})",
+                window_points,
+            )
+            result = None
+        results.append(result)
+
+    parts = []
+    for run in matched_runs(windows, results):
+        run_windows, run_results = zip(*run)
+        matched, pieces = stitch_windows(points, list(run_windows), list(run_results))
+        if len(matched) >= 2:
+            parts.append((matched, pieces))
+    return parts
+
 
+def tables_to_frame(buffers, geometry=True):
+    df = pd.concat(
+        [ipc_to_table(buffer).to_pandas() for buffer in buffers], ignore_index=True
+    )
+    if not geometry:
+        return df
+    return gpd.GeoDataFrame(
+        df.drop(columns="geometry"),
+        geometry=gpd.GeoSeries.from_wkb(df["geometry"]),
+        crs="EPSG:4326",
+    )
 
-def run_map_matching(gdf):
+
+def run_map_matching(
+    gdf,
+    service_area=None,
+    max_speed_kmh=MAX_SPEED_KMH,
+    trip_shapes=None,
+    workers=POSTPROCESS_WORKERS,
+):
+    gdf = prefilter_points(gdf, service_area, max_speed_kmh)
     trip_points = prepare_trips(gdf)
     failed_log = []
-
-    traj_rows = []
-    point_rows = []
-    shapes = []
-    for (veh_id, trip_id, route_id), points in tqdm.tqdm(
-        trip_points.items(), desc="Map matching"
-    ):
-        matched, shape = map_match_trip(
-            points, failed_log, vehicle_id=veh_id, trip_id=trip_id
-        )
-        if matched:
-            geom = LineString([(lon, lat) for (lon, lat, _) in matched])
-            traj_rows.append(
-                {
-                    "vehicle_id": veh_id,
-                    "trip_id": trip_id,
-                    "route_id": route_id,
-                    "geometry": geom,
-                }
-            )
-            for lon, lat, time in matched:
-                point_rows.append(
-                    {
-                        "vehicle_id": veh_id,
-                        "trip_id": trip_id,
-                        "route_id": route_id,
-                        "latitude": lat,
-                        "longitude": lon,
-                        "startdate": pd.to_datetime(time).date(),
-                        "timestamp": time,
-                    }
+    snapped_trips = 0
+
+    # El armado de geometrias y la serializacion se hacen en otros procesos,
+    # por lotes de trips, mientras se siguen matcheando los siguientes
+    futures = []
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (veh_id, trip_id, route_id), points in tqdm.tqdm(
+            trip_points.items(), desc="Map matching"
+        ):
+            parts = []
+            # Si el trip tiene shape programada se proyecta sobre ella, sin pasar por Valhalla
+            if trip_shapes and trip_id in trip_shapes:
+                matched, shape = snap_to_shape(points, trip_shapes[trip_id])
+                if matched:
+                    parts = [(matched, shape)]
+                    snapped_trips += 1
+            if not parts:
+                parts = map_match_trip(
+                    points, failed_log, vehicle_id=veh_id, trip_id=trip_id
                 )
-            shapes.append(
-                {
-                    "vehicle_id": veh_id,
-                    "trip_id": trip_id,
-                    "route_id": route_id,
-                    "geometry": LineString([(lon, lat) for lat, lon in shape or []]),
-                }
-            )
-
-    traj_df = gpd.GeoDataFrame(traj_rows, crs="EPSG:4326")
-    point_df = pd.DataFrame(point_rows)
-    shapes_gdf = gpd.GeoDataFrame(shapes, crs="EPSG:4326")
+            # Un trip con ventanas fallidas queda en varias partes, cada una con su trayectoria
+            for part, (matched, shape) in enumerate(parts):
+                batch.append((veh_id, trip_id, route_id, part, matched, shape or []))
+            if len(batch) >= POSTPROCESS_BATCH_SIZE:
+                futures.append(executor.submit(build_trip_outputs, batch))
+                batch = []
+        if batch:
+            futures.append(executor.submit(build_trip_outputs, batch))
+
+        results = [
+            future.result()
+            for future in tqdm.tqdm(futures, desc="Post-processing")
+        ]
+
+    if trip_shapes:
+        print(f"Snapped {snapped_trips} trips to their GTFS shape without Valhalla.")
+    if not results:
+        empty = gpd.GeoDataFrame([], crs="EPSG:4326")
+        return empty, failed_log, pd.DataFrame(), empty.copy()
+
+    point_df = tables_to_frame([r[0] for r in results], geometry=False)
+    traj_df = tables_to_frame([r[1] for r in results])
+    shapes_gdf = tables_to_frame([r[2] for r in results])
     return traj_df, failed_log, point_df, shapes_gdf
 
 
@@ -221,15 +468,53 @@ if __name__ == "__main__":
     parser.add_argument(
         "parquet_file", help="Path to the input Parquet file with vehicle positions"
     )
+    parser.add_argument(
+        "--service-area",
+        help="GeoJSON with the service area polygon (e.g. the exported province boundary); points outside it are dropped",
+    )
+    parser.add_argument(
+        "--max-speed",
+        type=float,
+        default=MAX_SPEED_KMH,
+        help=f"Speed in km/h above which isolated points are treated as GPS outliers (default: {MAX_SPEED_KMH})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=POSTPROCESS_WORKERS,
+        help="Number of processes used to build and serialize the matched geometries",
+    )
+    parser.add_argument(
+        "--snap-to-shapes",
+        action="store_true",
+        help="Project positions onto the scheduled GTFS shape of each trip, using Valhalla only as fallback",
+    )
+    parser.add_argument(
+        "--schedule-store",
+        help="Directory built by schedule_store.py; shapes are read from it instead of the database",
+    )
     args = parser.parse_args()
     parquet_file = args.parquet_file
+    service_area = load_service_area(args.service_area) if args.service_area else None
 
     df = pd.read_parquet(parquet_file)
 
     geometry = [Point(lon, lat) for lat, lon in zip(df["latitude"], df["longitude"])]
     gdf = gpd.GeoDataFrame(df, geometry=geometry)
 
-    matched_gdf, failed_log, point_df, shapes_gdf = run_map_matching(gdf)
+    trip_shapes = None
+    if args.snap_to_shapes:
+        store = ScheduleStore(args.schedule_store) if args.schedule_store else None
+        print("Loading GTFS shapes from " + ("schedule store..." if store else "database..."))
+        trip_shapes = load_trip_shapes(df["trip_id"].dropna().unique().tolist(), store=store)
+
+    matched_gdf, failed_log, point_df, shapes_gdf = run_map_matching(
+        gdf,
+        service_area=service_area,
+        max_speed_kmh=args.max_speed,
+        trip_shapes=trip_shapes,
+        workers=args.workers,
+    )
 
     # count distinct trips
     distinct_trips_len = matched_gdf["trip_id"].nunique()
@@ -242,30 +527,32 @@ if __name__ == "__main__":
         failed_df = pd.DataFrame(failed_log)
         save_failed_as_geojson(failed_log)
         print(
-            f"Failed map matching for {len(failed_log)} trips. Details saved to map_matching_errors.geojson"
+            f"Failed map matching for {len(failed_log)} trips or trace windows. Details saved to map_matching_errors.geojson"
         )
 
     # remove all rows that are duplicated (not including timestamp)
     point_df = point_df.drop_duplicates(
-        subset=["vehicle_id", "trip_id", "route_id", "latitude", "longitude"]
+        subset=["vehicle_id", "trip_id", "route_id", "part", "latitude", "longitude"]
     )
     point_df.to_csv("map_matched_positions.csv", index=False)
 
-    shapes_gdf.to_file("map_matched_shapes.geojson", driver="GeoJSON")
+    shapes_gdf.drop(columns="ewkt").to_file(
+        "map_matched_shapes.geojson", driver="GeoJSON"
+    )
 
-    # convert to regular DataFrame for CSV
+    # convert to regular DataFrame for CSV (EWKT already serialized by the workers)
     shapes_df = pd.DataFrame(
         {
             "vehicle_id": shapes_gdf["vehicle_id"],
             "trip_id": shapes_gdf["trip_id"],
             "route_id": shapes_gdf["route_id"],
-            "geometry": shapes_gdf["geometry"].apply(
-                lambda geom: f"SRID=4326;{geom.wkt}"
-            ),
+            "part": shapes_gdf["part"],
+            "geometry": shapes_gdf["ewkt"],
         }
     )
     shapes_df.to_csv("map_matched_shapes.csv", index=False)
 
-    print(
-        f"Discarded {discarded_points} points during map matching due to distance threshold."
-    )
+    total_discarded = sum(discarded_points.values())
+    print(f"Discarded {total_discarded} points before map matching:")
+    for reason, count in sorted(discarded_points.items()):
+        print(f"  {reason}: {count}")
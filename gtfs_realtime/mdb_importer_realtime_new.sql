@@ -1,11 +1,10 @@
-DO $$
-BEGIN
-
+-- stage: load_matched_csv
 DROP TABLE IF EXISTS realtime_positions;
 CREATE TABLE realtime_positions (
   vehicle_id text,
   trip_id text,
   route_id text,
+  part integer, -- tramo del trip; map_matching.py lo corta donde falla una ventana
   latitude float,
   longitude float,
   startdate date,
@@ -19,6 +18,7 @@ CREATE TABLE realtime_shapes (
   vehicle_id text,
   trip_id text,
   route_id text,
+  part integer,
   geometry geometry(LineString, 4326)
 );
 
@@ -26,6 +26,7 @@ COPY realtime_positions (
   vehicle_id,
   trip_id,
   route_id,
+  part,
   latitude,
   longitude,
   startdate,
@@ -40,24 +41,28 @@ COPY realtime_shapes (
   vehicle_id,
   trip_id,
   route_id,
+  part,
   geometry
 )
 FROM '/tmp/map_matched_shapes.csv' DELIMITER ',' CSV HEADER;
 
+-- stage: matched_points
 DROP TABLE IF EXISTS matched_points;
 CREATE TEMP TABLE matched_points AS
 SELECT 
     rp.trip_id,
     rp.route_id,
     rp.vehicle_id,
+    rp.part,
     rp.startdate,
     rp.point_geom,
     rp.timestamp,
     ST_LineLocatePoint(rs.geometry, ST_SetSRID(ST_MakePoint(rp.longitude, rp.latitude), 4326)) AS fraction
 FROM realtime_positions rp
-JOIN realtime_shapes rs USING (trip_id, route_id, vehicle_id)
-ORDER BY rp.trip_id, rp.route_id, rp.vehicle_id, rp.startdate, rp.timestamp;
+JOIN realtime_shapes rs USING (trip_id, route_id, vehicle_id, part)
+ORDER BY rp.trip_id, rp.route_id, rp.vehicle_id, rp.part, rp.startdate, rp.timestamp;
 
+-- stage: all_shape_points
 -- Extract all shape points with their fractional positions
 DROP TABLE IF EXISTS all_shape_points;
 CREATE TEMP TABLE all_shape_points AS
@@ -65,20 +70,23 @@ SELECT
     rs.trip_id,
     rs.route_id,
     rs.vehicle_id,
+    rs.part,
     (dp).path[1] AS point_idx,
     (dp).geom AS point_geom,
     ST_LineLocatePoint(rs.geometry, (dp).geom) AS fraction
 FROM realtime_shapes rs
 JOIN LATERAL ST_DumpPoints(rs.geometry) AS dp ON true;
 
+-- stage: numbered_matched_points
 -- Create a numbered sequence of matched points for each trip
 DROP TABLE IF EXISTS numbered_matched_points;
 CREATE TEMP TABLE numbered_matched_points AS
 SELECT 
     mp.*,
-    ROW_NUMBER() OVER (PARTITION BY trip_id, route_id, vehicle_id, startdate ORDER BY timestamp) AS point_num
+    ROW_NUMBER() OVER (PARTITION BY trip_id, route_id, vehicle_id, part, startdate ORDER BY timestamp) AS point_num
 FROM matched_points mp;
 
+-- stage: segments
 -- Create segments between consecutive matched points
 DROP TABLE IF EXISTS segments;
 CREATE TEMP TABLE segments AS
@@ -86,6 +94,7 @@ SELECT
     n1.trip_id,
     n1.route_id,
     n1.vehicle_id,
+    n1.part,
     n1.startdate,
     n1.point_geom AS start_point,
     n2.point_geom AS end_point,
@@ -99,9 +108,11 @@ JOIN numbered_matched_points n2
     ON n1.trip_id = n2.trip_id 
     AND n1.route_id = n2.route_id 
     AND n1.vehicle_id = n2.vehicle_id 
+    AND n1.part = n2.part
     AND n1.startdate = n2.startdate
     AND n1.point_num = n2.point_num - 1;
 
+-- stage: shape_points_with_segments
 -- Join shape points with segments to interpolate times
 DROP TABLE IF EXISTS shape_points_with_segments;
 CREATE TEMP TABLE shape_points_with_segments AS
@@ -109,6 +120,7 @@ SELECT
     sp.trip_id,
     sp.route_id,
     sp.vehicle_id,
+    sp.part,
     sp.point_geom,
     sp.fraction AS shape_frac,
     s.segment_num,
@@ -128,9 +140,11 @@ JOIN segments s
     ON sp.trip_id = s.trip_id 
     AND sp.route_id = s.route_id 
     AND sp.vehicle_id = s.vehicle_id
+    AND sp.part = s.part
 WHERE sp.fraction BETWEEN 
     LEAST(s.start_frac, s.end_frac) AND GREATEST(s.start_frac, s.end_frac);
 
+-- stage: interpolated_shape_points
 -- Calculate interpolated times for shape points
 DROP TABLE IF EXISTS interpolated_shape_points;
 CREATE TABLE interpolated_shape_points AS
@@ -138,11 +152,13 @@ SELECT
     trip_id,
     route_id,
     vehicle_id,
+    part,
     point_geom,
     start_time + (end_time - start_time) * interpolation_factor AS interpolated_time
 FROM shape_points_with_segments
 WHERE interpolation_factor BETWEEN 0 AND 1;
 
+-- stage: all_timed_points
 -- Combine original matched points with interpolated shape points
 DROP TABLE IF EXISTS all_timed_points;
 CREATE TEMP TABLE all_timed_points AS
@@ -167,6 +183,7 @@ JOIN matched_points mp
     ON isp.trip_id = mp.trip_id 
     AND isp.route_id = mp.route_id 
     AND isp.vehicle_id = mp.vehicle_id
+    AND isp.part = mp.part
 GROUP BY 
     isp.trip_id,
     isp.route_id,
@@ -175,6 +192,7 @@ GROUP BY
     isp.point_geom,
     isp.interpolated_time;
 
+-- stage: valid_timed_points
 -- Validate temporal ordering and remove duplicates
 DROP TABLE IF EXISTS valid_timed_points;
 CREATE TEMP TABLE valid_timed_points AS
@@ -200,6 +218,7 @@ WHERE
         AND NOT ST_Equals(point_geom, prev_geom)
     );
 
+-- stage: insert_realtime_trips_mdb
 -- Create the final trajectories
 DROP TABLE IF EXISTS realtime_trips_mdb;
 CREATE TABLE realtime_trips_mdb (
@@ -225,9 +244,7 @@ FROM valid_timed_points
 GROUP BY trip_id, route_id, startdate
 HAVING COUNT(*) > 1 AND ST_IsValid(ST_MakeLine(point_geom ORDER BY time));
 
+-- stage: delete_invalid_trajectories
 -- Remove any invalid trajectories
 DELETE FROM realtime_trips_mdb
 WHERE ST_GeometryType(traj) = 'ST_Point' OR NOT ST_IsSimple(traj);
-					   
-END; 
-$$;
\ No newline at end of file
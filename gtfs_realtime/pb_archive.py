@@ -0,0 +1,199 @@
+import argparse
+import bisect
+import mmap
+import os
+import re
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from definitions import gtfs_realtime_pb2
+
+# Cada registro del segmento es: fetch_time (float64), largo (uint32), bytes del FeedMessage
+RECORD_HEADER = struct.Struct("<dI")
+# Cada entrada del indice es: fetch_time, offset del payload en el segmento, largo
+INDEX_ENTRY = struct.Struct("<dqI")
+INDEX_DTYPE = np.dtype([("fetch_time", "<f8"), ("offset", "<i8"), ("length", "<u4")])
+MAX_SEGMENT_BYTES = 256 * 2**20
+
+
+def optional(*path):
+    """Getter for a nested proto2 field that returns None if any step is unset."""
+
+    def get(message):
+        for name in path:
+            if not message.HasField(name):
+                return None
+            message = getattr(message, name)
+        return message
+
+    return get
+
+
+# Campos que se pueden pedir al lector y como se obtienen de cada entidad.
+# Los campos ausentes quedan en None, no en el valor por defecto del proto (0 o "")
+POSITION_FIELDS = {
+    "vehicle_id": optional("vehicle", "id"),
+    "trip_id": optional("trip", "trip_id"),
+    "route_id": optional("trip", "route_id"),
+    "latitude": optional("position", "latitude"),
+    "longitude": optional("position", "longitude"),
+    "bearing": optional("position", "bearing"),
+    "current_stop_sequence": optional("current_stop_sequence"),
+    "start_date": optional("trip", "start_date"),
+    "start_time": optional("trip", "start_time"),
+    "timestamp": optional("timestamp"),
+}
+DEFAULT_FIELDS = ("vehicle_id", "trip_id", "route_id", "latitude", "longitude", "timestamp")
+
+
+class SegmentWriter:
+    """
+    Appends raw FeedMessage bytes to length-prefixed segment files, with a
+    fixed-size time index next to each segment. Nothing is parsed on write.
+    """
+
+    def __init__(self, directory, feed_name, max_segment_bytes=MAX_SEGMENT_BYTES):
+        self.directory = directory
+        self.feed_name = feed_name
+        self.max_segment_bytes = max_segment_bytes
+        self.segment = None
+        self.index = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self, fetch_time):
+        self.close()
+        base = os.path.join(self.directory, f"{self.feed_name}_{int(fetch_time * 1000)}")
+        self.segment = open(base + ".seg", "ab")
+        self.index = open(base + ".idx", "ab")
+
+    def append(self, raw, fetch_time=None):
+        fetch_time = time.time() if fetch_time is None else fetch_time
+        if self.segment is None or self.segment.tell() >= self.max_segment_bytes:
+            self._open_segment(fetch_time)
+        offset = self.segment.tell() + RECORD_HEADER.size
+        self.segment.write(RECORD_HEADER.pack(fetch_time, len(raw)))
+        self.segment.write(raw)
+        self.segment.flush()
+        self.index.write(INDEX_ENTRY.pack(fetch_time, offset, len(raw)))
+        self.index.flush()
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+
+class ArchiveReader:
+    """
+    Memory-maps the segments of a feed and decodes snapshots only when they
+    are requested, selecting them by fetch time through the indexes. Each
+    selected snapshot is parsed whole; fields are chosen only on output.
+    """
+
+    def __init__(self, directory, feed_name):
+        self.segments = []
+        # Solo los segmentos de este feed: "vp" no debe tomar los de "vp_extra"
+        pattern = re.compile(re.escape(feed_name) + r"_(\d+)\.seg")
+        matches = [pattern.fullmatch(name) for name in os.listdir(directory)]
+        paths = [
+            os.path.join(directory, m.group(0))
+            for m in sorted(filter(None, matches), key=lambda m: int(m.group(1)))
+        ]
+        for path in paths:
+            with open(path[:-4] + ".idx", "rb") as f:
+                raw_index = f.read()
+            # Una entrada incompleta al final (corte durante la escritura) se ignora
+            usable = len(raw_index) - len(raw_index) % INDEX_DTYPE.itemsize
+            index = np.frombuffer(raw_index[:usable], dtype=INDEX_DTYPE)
+            if len(index) == 0:
+                continue
+            f = open(path, "rb")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.segments.append((index, f, data))
+        self.starts = [index["fetch_time"][0] for index, _, _ in self.segments]
+
+    def snapshots(self, start=None, end=None):
+        """
+        Yields (fetch_time, memoryview over the raw FeedMessage) for every
+        snapshot with start <= fetch_time < end, without copying the bytes.
+        """
+        first = 0 if start is None else max(bisect.bisect_right(self.starts, start) - 1, 0)
+        for index, _, data in self.segments[first:]:
+            times = index["fetch_time"]
+            if end is not None and times[0] >= end:
+                return
+            lo = 0 if start is None else np.searchsorted(times, start, side="left")
+            hi = len(times) if end is None else np.searchsorted(times, end, side="left")
+            view = memoryview(data)
+            for fetch_time, offset, length in index[lo:hi]:
+                yield float(fetch_time), view[offset : offset + length]
+
+    def feeds(self, start=None, end=None):
+        for fetch_time, raw in self.snapshots(start, end):
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(raw)
+            yield fetch_time, feed
+
+    def vehicle_positions(self, start=None, end=None, fields=DEFAULT_FIELDS):
+        """
+        Vehicle entities in [start, end) as a DataFrame with the given `fields`
+        (None where the feed left a field unset).
+        """
+        getters = [(name, POSITION_FIELDS[name]) for name in fields]
+        columns = {name: [] for name in fields}
+        columns["fetch_time"] = []
+        for fetch_time, feed in self.feeds(start, end):
+            for entity in feed.entity:
+                if not entity.HasField("vehicle"):
+                    continue
+                vehicle = entity.vehicle
+                for name, getter in getters:
+                    columns[name].append(getter(vehicle))
+                columns["fetch_time"].append(fetch_time)
+        return pd.DataFrame(columns)
+
+    def close(self):
+        for _, f, data in self.segments:
+            data.close()
+            f.close()
+        self.segments = []
+        self.starts = []
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a time range of an archived GTFS-RT feed to Parquet."
+    )
+    parser.add_argument("archive_dir", help="Directory with the .seg/.idx files")
+    parser.add_argument("feed_name")
+    parser.add_argument("output", help="Parquet file to write")
+    parser.add_argument("--start", help="Start time (epoch or ISO format)")
+    parser.add_argument("--end", help="End time (epoch or ISO format), exclusive")
+    parser.add_argument(
+        "--fields",
+        nargs="+",
+        default=list(DEFAULT_FIELDS),
+        choices=list(POSITION_FIELDS),
+        help="Vehicle fields to decode",
+    )
+    args = parser.parse_args()
+
+    reader = ArchiveReader(args.archive_dir, args.feed_name)
+    df = reader.vehicle_positions(parse_time(args.start), parse_time(args.end), args.fields)
+    reader.close()
+    df.to_parquet(args.output, index=False)
+    print(f"{len(df)} vehicle positions saved to {args.output}")
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import statistics
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from definitions import gtfs_realtime_pb2
+
+DEFAULT_INTERVAL = 20
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 120
+# Margen (s) despues de la publicacion esperada, para no llegar antes que el feed
+PUBLISH_MARGIN = 0.5
+# Espera inicial antes de reintentar cuando el feed todavia no se actualizo
+RETRY_DELAY = 1.0
+HISTORY = 30
+# Intervalos recientes con los que se estima la cadencia
+CADENCE_WINDOW = 9
+# Snapshots nuevos seguidos, sin ningun repetido, a partir de los cuales se prueba consultar mas seguido
+PROBE_STREAK = 10
+# Relacion maxima entre el reloj del encabezado y el reloj de pared para confiar en el encabezado
+CLOCK_RATE_TOLERANCE = 1.5
+
+
+def header_timestamp(raw):
+    """
+    FeedHeader.timestamp of a serialized FeedMessage, decoding only the
+    header (field 1, written first by the usual encoders). Returns None if
+    the header has no timestamp.
+    """
+    if raw[:1] == b"\x0a":
+        length, shift, i = 0, 0, 1
+        while i < len(raw):
+            byte = raw[i]
+            length |= (byte & 0x7F) << shift
+            i += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+        header = gtfs_realtime_pb2.FeedHeader()
+        header.ParseFromString(raw[i : i + length])
+    else:
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(raw)
+        header = feed.header
+    return float(header.timestamp) if header.timestamp else None
+
+
+def last_modified(headers):
+    """Last-Modified response header as epoch seconds, or None."""
+    value = headers.get("Last-Modified") if headers else None
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class AdaptivePoller:
+    """
+    Schedules the polls of one feed. Learns the publish cadence in wall-clock
+    time from the arrival of new snapshots and aims each request just after
+    the next expected publish, discounting the delay until a snapshot becomes
+    visible and half the request latency. The publish time comes from
+    FeedHeader.timestamp or Last-Modified while that clock keeps pace with the
+    wall clock; otherwise (replays, wrong clocks, no header) it is estimated
+    from when a changed payload first appears. Polls follow absolute times,
+    so fetch time never accumulates as drift.
+    """
+
+    def __init__(
+        self,
+        name,
+        default_interval=DEFAULT_INTERVAL,
+        min_interval=MIN_INTERVAL,
+        max_interval=MAX_INTERVAL,
+        margin=PUBLISH_MARGIN,
+    ):
+        self.name = name
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.margin = margin
+
+        self.gaps = deque(maxlen=HISTORY)
+        self.clock_rates = deque(maxlen=HISTORY)
+        self.visible_delays = deque(maxlen=HISTORY)
+        self.latencies = deque(maxlen=HISTORY)
+        self.staleness = deque(maxlen=HISTORY)
+        self.last_version = None
+        self.last_publish = None
+        self.last_seen = None
+        self.last_header = None
+        self.last_duplicate_seen = None
+        self.streak = 0
+        self.last_start = None
+        self.retry_delay = RETRY_DELAY
+        self.next_poll = time.time()
+
+        self.polls = 0
+        self.failures = 0
+        self.duplicates = 0
+
+    @property
+    def cadence(self):
+        """Learned wall-clock time between publishes, or None until two publishes were seen."""
+        if not self.gaps:
+            return None
+        # Si se saltea algun snapshot el intervalo observado es un multiplo de la cadencia: se toma el menor
+        recent = list(self.gaps)[-CADENCE_WINDOW:]
+        return min(max(min(recent), self.min_interval), self.max_interval)
+
+    def header_clock_ok(self, header_time, seen):
+        """Whether the feed's publish clock can be used as wall-clock time."""
+        if header_time is None or abs(seen - header_time) > self.max_interval:
+            return False
+        if len(self.clock_rates) < 2:
+            return True
+        rate = statistics.median(self.clock_rates)
+        return 1 / CLOCK_RATE_TOLERANCE <= rate <= CLOCK_RATE_TOLERANCE
+
+    def wait(self):
+        delay = self.next_poll - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.last_start = time.time()
+        return self.last_start
+
+    def record(self, started, finished, publish_time=None, payload=None):
+        """
+        Registers the result of a poll and schedules the next one. Returns
+        True if the snapshot is new, False for a duplicate or a failed fetch.
+        """
+        self.polls += 1
+        if payload is None:
+            self.failures += 1
+            self.next_poll = started + self.default_interval
+            return False
+
+        latency = finished - started
+        self.latencies.append(latency)
+        seen = started + latency / 2
+        # El encabezado tiene resolucion de segundos: el contenido distingue versiones del mismo segundo
+        version = (publish_time, hashlib.blake2b(payload, digest_size=16).digest())
+        if version == self.last_version:
+            self.duplicates += 1
+            self.streak = 0
+            self.last_duplicate_seen = seen
+            self._schedule_retry(seen)
+            return False
+
+        self.last_version = version
+        self.retry_delay = RETRY_DELAY
+        header_time = publish_time
+        if publish_time is not None and self.last_header is not None:
+            if seen > self.last_seen:
+                self.clock_rates.append((publish_time - self.last_header) / (seen - self.last_seen))
+            # Contenido nuevo con el mismo segundo en el encabezado: publica mas rapido que su resolucion
+            if publish_time <= self.last_header:
+                header_time = None
+        self.last_header = publish_time
+
+        if self.header_clock_ok(header_time, seen):
+            publish = header_time
+        elif self.last_duplicate_seen is not None:
+            # Se publico entre la ultima consulta repetida y esta
+            publish = (self.last_duplicate_seen + seen) / 2
+        else:
+            publish = seen
+        if self.last_publish is not None and publish > self.last_publish:
+            self.gaps.append(publish - self.last_publish)
+        self.last_publish = publish
+        self.last_seen = seen
+        self.last_duplicate_seen = None
+        self.streak += 1
+
+        self.visible_delays.append(max(seen - publish, 0))
+        self.staleness.append(max(finished - publish, 0))
+        self._schedule_next(started)
+        return True
+
+    def _schedule_next(self, started):
+        cadence = self.cadence
+        if cadence is None:
+            self.next_poll = started + self.default_interval
+            return
+        # Todos los snapshots salieron nuevos: el feed puede publicar mas seguido de lo estimado.
+        # Mientras no hubo ningun repetido la cadencia es solo una cota, y se prueba enseguida
+        probe_streak = PROBE_STREAK if self.duplicates else 2
+        if self.streak >= probe_streak:
+            cadence = max(cadence / 2 ** (self.streak - probe_streak + 1), self.min_interval)
+        # Publicacion esperada + demora minima observada hasta que se ve, menos media latencia
+        margin = min(self.margin, cadence / 4)
+        offset = min(self.visible_delays) + margin - statistics.median(self.latencies) / 2
+        expected = self.last_publish + cadence
+        while expected + offset <= time.time():
+            expected += cadence
+        self.next_poll = expected + offset
+
+    def _schedule_retry(self, seen):
+        cadence = self.cadence or self.default_interval
+        # Todavia no hay snapshot nuevo: reintento corto, con backoff, sin pasarse de media cadencia
+        self.next_poll = seen + min(self.retry_delay, cadence / 2)
+        self.retry_delay *= 2
+
+    def metrics(self):
+        successful = self.polls - self.failures
+        new = successful - self.duplicates
+        latencies = list(self.latencies)
+        staleness = list(self.staleness)
+        return {
+            "feed": self.name,
+            "polls": self.polls,
+            "failures": self.failures,
+            "new_snapshots": new,
+            "duplicates": self.duplicates,
+            "duplicate_rate": self.duplicates / successful if successful else None,
+            "polls_per_snapshot": self.polls / new if new else None,
+            "cadence_s": self.cadence,
+            "latency_mean_s": statistics.mean(latencies) if latencies else None,
+            "latency_p95_s": percentile(latencies, 95),
+            "staleness_mean_s": statistics.mean(staleness) if staleness else None,
+            "staleness_p95_s": percentile(staleness, 95),
+        }
+
+    def summary(self):
+        m = self.metrics()
+
+        def fmt(value, spec=".2f"):
+            return "n/a" if value is None else format(value, spec)
+
+        return (
+            f"[{m['feed']}] {m['polls']} polls, {m['new_snapshots']} new, "
+            f"{m['duplicates']} duplicates ({fmt(m['duplicate_rate'], '.0%')}), "
+            f"{m['failures']} failures; cadence {fmt(m['cadence_s'], '.1f')} s, "
+            f"latency {fmt(m['latency_mean_s'])} s (p95 {fmt(m['latency_p95_s'])}), "
+            f"staleness {fmt(m['staleness_mean_s'])} s (p95 {fmt(m['staleness_p95_s'])})"
+        )
+
+    def log_metrics(self):
+        logging.info(self.summary())
@@ -0,0 +1,109 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import shapely
+from polyline import decode
+
+# Cantidad de trips que procesa cada worker por tarea
+POSTPROCESS_BATCH_SIZE = 200
+POSTPROCESS_WORKERS = os.cpu_count()
+
+
+def nearest_vertex(shape, lon, lat):
+    return min(
+        range(len(shape)),
+        key=lambda i: (shape[i][0] - lat) ** 2 + (shape[i][1] - lon) ** 2,
+    )
+
+
+def join_shape_pieces(pieces):
+    """
+    Builds a trip shape as a list of (lat, lon) from its pieces. Each piece is
+    (coords, cut_start, cut_end) where coords is either an encoded polyline
+    (precision 6) or a list of (lat, lon), and the optional cuts are (lon, lat)
+    locations at whose nearest vertex the piece is trimmed.
+    """
+    shape = []
+    for coords, cut_start, cut_end in pieces:
+        if isinstance(coords, str):
+            coords = decode(coords, precision=6)
+        if not coords:
+            continue
+        i_start = 0 if cut_start is None else nearest_vertex(coords, *cut_start)
+        i_end = len(coords)
+        if cut_end is not None:
+            i_end = max(nearest_vertex(coords, *cut_end), i_start) + 1
+        piece = coords[i_start:i_end]
+        if shape and piece and tuple(shape[-1]) == tuple(piece[0]):
+            piece = piece[1:]
+        shape.extend(piece)
+    return shape
+
+
+def table_to_ipc(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def ipc_to_table(buffer):
+    return pa.ipc.open_stream(buffer).read_all()
+
+
+def build_trip_outputs(batch):
+    """
+    Worker task: decodes shapes, builds geometries and serializes them for a
+    batch of (vehicle_id, trip_id, route_id, part, matched, shape_pieces)
+    tuples, where part numbers the pieces of a trip split at failed windows.
+    Returns Arrow IPC buffers for the points, trajectories and shapes tables;
+    geometries travel as WKB so the parent does not rebuild them.
+    """
+    ids = {"vehicle_id": [], "trip_id": [], "route_id": [], "part": []}
+    point_ids = {"vehicle_id": [], "trip_id": [], "route_id": [], "part": []}
+    lons, lats, times, traj_index = [], [], [], []
+    shape_geoms = []
+
+    for i, (veh_id, trip_id, route_id, part, matched, pieces) in enumerate(batch):
+        for key, value in zip(ids, (veh_id, trip_id, route_id, part)):
+            ids[key].append(value)
+            point_ids[key].extend([value] * len(matched))
+        for lon, lat, time in matched:
+            lons.append(lon)
+            lats.append(lat)
+            times.append(time)
+        traj_index.extend([i] * len(matched))
+
+        shape = join_shape_pieces(pieces)
+        shape_geoms.append(
+            shapely.LineString([(lon, lat) for lat, lon in shape])
+            if len(shape) > 1
+            else shapely.LineString()
+        )
+
+    traj_geoms = shapely.linestrings(list(zip(lons, lats)), indices=traj_index)
+
+    points = pd.DataFrame(
+        {
+            **point_ids,
+            "latitude": lats,
+            "longitude": lons,
+            "startdate": pd.to_datetime(pd.Series(times)).dt.date,
+            "timestamp": times,
+        }
+    )
+    trajectories = pd.DataFrame({**ids, "geometry": shapely.to_wkb(traj_geoms)})
+    shapes = pd.DataFrame(
+        {
+            **ids,
+            "geometry": shapely.to_wkb(shape_geoms),
+            "ewkt": [
+                "SRID=4326;" + wkt
+                for wkt in shapely.to_wkt(shape_geoms, rounding_precision=-1)
+            ],
+        }
+    )
+    return tuple(
+        table_to_ipc(pa.Table.from_pandas(df, preserve_index=False))
+        for df in (points, trajectories, shapes)
+    )
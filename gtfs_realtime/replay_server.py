@@ -0,0 +1,318 @@
+import argparse
+import bisect
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from definitions import gtfs_realtime_pb2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MIN_SPEED = 1
+MAX_SPEED = 1000
+
+PB_PATH = re.compile(r"^/v2/vehiclepositions/gtfsrt/(?P<feed>[^/]+)\.pb$")
+GEOJSON_PATH = re.compile(r"^(/feeds/(?P<feed>[^/]+))?/v2/public/vehiclepositions/?$")
+
+
+def to_epoch(series):
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().all():
+        return numeric.astype(float)
+    parsed = pd.to_datetime(series, utc=True)
+    return (parsed - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+
+
+def load_parquet_positions(path):
+    """
+    Reads a capture from rest_gtfs_rt_inspector.py or gtfs_rt_inspector.py and
+    returns one row per vehicle position with a `snapshot_time` column.
+    """
+    df = pd.read_parquet(path)
+    if "vehicle" in df.columns:
+        # Formato de gtfs_rt_inspector.py: entidades convertidas con MessageToDict.
+        # pyarrow devuelve None para los structs ausentes, y sin posicion no hay nada que servir
+        df = df[df["vehicle"].map(lambda v: bool(v) and bool(v.get("position")))]
+        vehicles = df["vehicle"]
+        df = pd.DataFrame(
+            {
+                "snapshot_time": to_epoch(df["fetch_time"]),
+                "vehicle_id": vehicles.map(lambda v: (v.get("vehicle") or {}).get("id")),
+                "trip_id": vehicles.map(lambda v: (v.get("trip") or {}).get("tripId")),
+                "route_id": vehicles.map(lambda v: (v.get("trip") or {}).get("routeId")),
+                "latitude": vehicles.map(lambda v: v["position"].get("latitude")),
+                "longitude": vehicles.map(lambda v: v["position"].get("longitude")),
+                "timestamp": pd.to_numeric(
+                    vehicles.map(lambda v: v.get("timestamp")), errors="coerce"
+                ),
+            }
+        )
+        df = df.dropna(subset=["latitude", "longitude"])
+    else:
+        df = df.assign(snapshot_time=to_epoch(df["timestamp"]))
+        df["timestamp"] = df["snapshot_time"]
+    return df
+
+
+class Snapshot:
+    """One feed poll. Serialized forms are built lazily and cached."""
+
+    def __init__(self, time, positions=None, raw_pb=None):
+        self.time = time
+        self.positions = positions
+        self.raw_pb = raw_pb
+        self._geojson = None
+        self._served_pb = None
+        self._served_key = None
+        self._lock = threading.Lock()
+
+    def get_positions(self):
+        if self.positions is None:
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(self.raw_pb)
+            self.positions = pd.DataFrame(
+                [
+                    {
+                        "vehicle_id": e.vehicle.vehicle.id,
+                        "trip_id": e.vehicle.trip.trip_id,
+                        "route_id": e.vehicle.trip.route_id,
+                        "latitude": e.vehicle.position.latitude,
+                        "longitude": e.vehicle.position.longitude,
+                        "timestamp": e.vehicle.timestamp or feed.header.timestamp,
+                    }
+                    for e in feed.entity
+                    if e.HasField("vehicle")
+                ]
+            )
+        return self.positions
+
+    def as_pb(self, clock=None):
+        """
+        Serialized FeedMessage. With `clock`, a (key, to_wall) pair, the header
+        and entity timestamps are mapped onto the replay's wall clock; the
+        result is cached until the key changes (new start or loop cycle).
+        """
+        with self._lock:
+            if self.raw_pb is None:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.header.gtfs_realtime_version = "2.0"
+                feed.header.timestamp = int(self.time)
+                for i, row in enumerate(self.positions.itertuples(index=False)):
+                    has_vehicle_id = pd.notna(row.vehicle_id) and row.vehicle_id != ""
+                    entity = feed.entity.add()
+                    # El id de entidad es obligatorio: sin vehicle_id se usa la posicion en el snapshot
+                    entity.id = str(row.vehicle_id) if has_vehicle_id else str(i)
+                    vehicle = entity.vehicle
+                    if isinstance(row.trip_id, str):
+                        vehicle.trip.trip_id = row.trip_id
+                    if isinstance(row.route_id, str):
+                        vehicle.trip.route_id = row.route_id
+                    if has_vehicle_id:
+                        vehicle.vehicle.id = str(row.vehicle_id)
+                    vehicle.position.latitude = row.latitude
+                    vehicle.position.longitude = row.longitude
+                    if pd.notna(row.timestamp):
+                        vehicle.timestamp = int(row.timestamp)
+                self.raw_pb = feed.SerializeToString()
+            if clock is None:
+                return self.raw_pb
+            key, to_wall = clock
+            if self._served_key != key:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.ParseFromString(self.raw_pb)
+                feed.header.timestamp = int(to_wall(feed.header.timestamp or self.time))
+                for entity in feed.entity:
+                    for field in ("vehicle", "trip_update"):
+                        message = getattr(entity, field)
+                        if entity.HasField(field) and message.HasField("timestamp"):
+                            message.timestamp = int(to_wall(message.timestamp))
+                self._served_pb = feed.SerializeToString()
+                self._served_key = key
+            return self._served_pb
+
+    def as_geojson(self):
+        with self._lock:
+            if self._geojson is None:
+                positions = self.get_positions()
+                positions = positions.astype(object).where(positions.notna(), None)
+                features = [
+                    {
+                        "type": "Feature",
+                        "geometry": {
+                            "type": "Point",
+                            "coordinates": [row.longitude, row.latitude],
+                        },
+                        "properties": {
+                            "gtfs_route_short_name": row.route_id,
+                            "gtfs_trip_id": row.trip_id,
+                            "vehicle_id": row.vehicle_id,
+                        },
+                    }
+                    for row in positions.itertuples(index=False)
+                ]
+                self._geojson = json.dumps(
+                    {"type": "FeatureCollection", "features": features}
+                ).encode()
+            return self._geojson
+
+
+class ReplayFeed:
+    """
+    A recorded feed played back on its own virtual clock, `speed` times faster
+    than real time, counted from the last call to start(). Served timestamps
+    are mapped onto the wall clock, so a collector sees the replay's cadence
+    and not the capture's.
+    """
+
+    def __init__(self, name, snapshots, speed=1, loop=False):
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"Speed must be between {MIN_SPEED} and {MAX_SPEED}")
+        self.name = name
+        self.snapshots = sorted(snapshots, key=lambda s: s.time)
+        self.times = [s.time for s in self.snapshots]
+        self.speed = speed
+        self.loop = loop
+        self.start()
+
+    def start(self):
+        self.started = time.monotonic()
+        self.started_wall = time.time()
+
+    @property
+    def duration(self):
+        return self.times[-1] - self.times[0]
+
+    def current(self):
+        """
+        Snapshot that would be published at this moment and the number of
+        completed loops, or None once finished.
+        """
+        elapsed = (time.monotonic() - self.started) * self.speed
+        cycle = 0
+        if self.loop and self.duration > 0:
+            cycle, elapsed = divmod(elapsed, self.duration)
+        elif elapsed > self.duration:
+            return None
+        i = bisect.bisect_right(self.times, self.times[0] + elapsed) - 1
+        return self.snapshots[max(i, 0)], int(cycle)
+
+    def wall_time(self, t, cycle=0):
+        """Wall-clock time at which capture time `t` is replayed in the given loop."""
+        return self.started_wall + (cycle * self.duration + t - self.times[0]) / self.speed
+
+    def clock(self, cycle=0):
+        return (self.started_wall, cycle), lambda t: self.wall_time(t, cycle)
+
+
+def load_feed(name, path, speed=1, loop=False):
+    """Loads a directory of .pb snapshots or a captured parquet file."""
+    if os.path.isdir(path):
+        snapshots = []
+        for pb_path in glob.glob(os.path.join(path, "*.pb")):
+            with open(pb_path, "rb") as f:
+                raw = f.read()
+            header = gtfs_realtime_pb2.FeedMessage()
+            header.ParseFromString(raw)
+            snapshots.append(Snapshot(header.header.timestamp, raw_pb=raw))
+    else:
+        positions = load_parquet_positions(path)
+        snapshots = [
+            Snapshot(snapshot_time, positions=group.drop(columns="snapshot_time"))
+            for snapshot_time, group in positions.groupby("snapshot_time", sort=True)
+        ]
+    if not snapshots:
+        raise ValueError(f"No snapshots found in {path}")
+    return ReplayFeed(name, snapshots, speed, loop)
+
+
+def make_handler(feeds):
+    default_feed = next(iter(feeds.values()))
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            pb_match = PB_PATH.match(path)
+            geojson_match = GEOJSON_PATH.match(path)
+            if pb_match:
+                feed = feeds.get(pb_match.group("feed"))
+                content_type = "application/x-protobuf"
+            elif geojson_match:
+                name = geojson_match.group("feed")
+                feed = feeds.get(name) if name else default_feed
+                content_type = "application/json"
+            else:
+                feed = None
+            if feed is None:
+                self.send_error(404)
+                return
+
+            current = feed.current()
+            if current is None:
+                self.send_error(410, "Replay finished")
+                return
+            snapshot, cycle = current
+            body = snapshot.as_pb(feed.clock(cycle)) if pb_match else snapshot.as_geojson()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header(
+                "Last-Modified", formatdate(feed.wall_time(snapshot.time, cycle), usegmt=True)
+            )
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve recorded vehicle positions as live GTFS-RT / Golemio feeds."
+    )
+    parser.add_argument(
+        "feeds",
+        nargs="+",
+        metavar="NAME=PATH",
+        help="Feed name and a captured parquet file or directory of .pb snapshots",
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help=f"Replay speed multiplier ({MIN_SPEED}-{MAX_SPEED})",
+    )
+    parser.add_argument("--loop", action="store_true", help="Restart feeds when they end")
+    args = parser.parse_args()
+
+    feeds = {}
+    for spec in args.feeds:
+        name, _, path = spec.partition("=")
+        feeds[name] = load_feed(name, path, args.speed, args.loop)
+        logging.info(
+            f"Feed '{name}': {len(feeds[name].snapshots)} snapshots, "
+            f"{feeds[name].duration / args.speed:.0f} s at {args.speed}x"
+        )
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(feeds))
+    # Todos los feeds arrancan juntos, una vez terminada la carga
+    for feed in feeds.values():
+        feed.start()
+    for name in feeds:
+        logging.info(
+            f"Serving http://127.0.0.1:{args.port}/v2/vehiclepositions/gtfsrt/{name}.pb "
+            f"and http://127.0.0.1:{args.port}/feeds/{name}/v2/public/vehiclepositions"
+        )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -4,9 +4,12 @@ import time
 from datetime import datetime
 import signal
 import sys
+import os
+from poll_scheduler import AdaptivePoller, last_modified
 
-API_URL = "https://api.golemio.cz/v2/public/vehiclepositions"
-INTERVAL = 20  # seconds between requests
+# GOLEMIO_API_URL permite apuntar a otro servidor, p.ej. replay_server.py
+API_URL = os.environ.get("GOLEMIO_API_URL", "https://api.golemio.cz/v2/public/vehiclepositions")
+INTERVAL = 20  # seconds between requests until the feed cadence is learned
 running = True
 data = []
 
@@ -38,14 +41,22 @@ headers = {
 
 print(f"Fetching data from Golemio for {duration} seconds... Press Ctrl+C to stop early.")
 
+poller = AdaptivePoller("golemio", default_interval=INTERVAL)
 start_time = time.time()
 
 while running and (time.time() - start_time < duration):
+    started = poller.wait()
+    recorded = False
     try:
         response = requests.get(API_URL, headers=headers, timeout=10)
         response.raise_for_status()
+        finished = time.time()
+        # Sin Last-Modified, el poller detecta respuestas repetidas por el contenido
+        recorded = True
+        if not poller.record(started, finished, last_modified(response.headers), response.content):
+            continue
         payload = response.json()
-        timestamp = datetime.utcnow().isoformat()
+        timestamp = datetime.utcfromtimestamp(finished).isoformat()
 
         for feature in payload.get("features", []):
             coords = feature["geometry"]["coordinates"]
@@ -63,8 +74,10 @@ while running and (time.time() - start_time < duration):
         print(f"{datetime.now()}: {len(payload['features'])} vehicles recorded.")
     except Exception as e:
         print(f"Error: {e}")
+        if not recorded:
+            poller.record(started, time.time())
 
-    time.sleep(INTERVAL)
+print(poller.summary())
 
 # Remove duplicates ignoring timestamp
 df = pd.DataFrame(data)
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+# Database configuration
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "prague",
+    "user": "postgres",
+    "port": "25432",
+}
+
+STORE_VERSION = 1
+DEFAULT_STORE = "schedule_store"
+STORE_ARRAYS = (
+    "route_ids", "route_type", "route_short_name",
+    "stop_ids", "stop_name", "stop_lon", "stop_lat", "stop_x", "stop_y",
+    "shape_ids", "shape_offsets", "shape_x", "shape_y",
+    "trip_ids", "trip_route", "trip_shape", "trip_direction",
+    "stop_offsets", "st_stop", "st_sequence", "st_arrival", "st_departure",
+)
+
+ROUTES_QUERY = "SELECT route_id, route_type, route_short_name FROM routes;"
+TRIPS_QUERY = "SELECT trip_id, route_id, shape_id, direction_id FROM trips;"
+STOPS_QUERY = """
+SELECT stop_id,
+       stop_name,
+       ST_X(stop_loc::geometry) AS lon,
+       ST_Y(stop_loc::geometry) AS lat,
+       ST_X(ST_Transform(stop_loc::geometry, 5514)) AS x,
+       ST_Y(ST_Transform(stop_loc::geometry, 5514)) AS y
+FROM stops;
+"""
+STOP_TIMES_QUERY = """
+SELECT trip_id,
+       stop_sequence,
+       stop_id,
+       EXTRACT(EPOCH FROM arrival_time)::int AS arrival,
+       EXTRACT(EPOCH FROM departure_time)::int AS departure
+FROM stop_times
+ORDER BY trip_id, stop_sequence;
+"""
+SHAPES_QUERY = """
+SELECT shape_id,
+       ST_X(ST_Transform(shape_pt_loc::geometry, 5514)) AS x,
+       ST_Y(ST_Transform(shape_pt_loc::geometry, 5514)) AS y
+FROM shapes
+ORDER BY shape_id, shape_pt_sequence;
+"""
+
+
+def encode_ids(values):
+    """GTFS ids as a fixed-width bytes array, which can be memory-mapped and searched."""
+    values = np.asarray(values, dtype=str)
+    if len(values) == 0:
+        return np.zeros(0, dtype="S1")
+    return np.char.encode(values, "utf-8")
+
+
+def intern(sorted_ids, values):
+    """Positions of `values` in `sorted_ids`, -1 for the ones not found."""
+    values = encode_ids(values)
+    if len(sorted_ids) == 0:
+        return np.full(len(values), -1, dtype=np.int32)
+    pos = np.searchsorted(sorted_ids, values)
+    pos = np.minimum(pos, len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == values, pos, -1).astype(np.int32)
+
+
+def csr_offsets(codes, size):
+    """Row offsets for rows already grouped by `codes` (0..size-1)."""
+    counts = np.bincount(codes, minlength=size)
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def build_store(directory):
+    """
+    Compiles routes, trips, stops, stop_times and shapes from PostgreSQL into
+    one .npy file per column. Ids are interned as indexes into sorted id
+    arrays; stop_times and shape points are stored in CSR layout, so the rows
+    of trip i are stop_offsets[i]:stop_offsets[i + 1] (same for shapes).
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    routes = pd.read_sql_query(ROUTES_QUERY, conn)
+    trips = pd.read_sql_query(TRIPS_QUERY, conn)
+    stops = pd.read_sql_query(STOPS_QUERY, conn)
+    stop_times = pd.read_sql_query(STOP_TIMES_QUERY, conn)
+    shapes = pd.read_sql_query(SHAPES_QUERY, conn)
+    conn.close()
+
+    arrays = {}
+    route_ids = np.unique(encode_ids(routes["route_id"]))
+    routes = routes.set_index(encode_ids(routes["route_id"])).loc[route_ids]
+    arrays["route_ids"] = route_ids
+    arrays["route_type"] = routes["route_type"].astype(int).to_numpy(dtype=np.int16)
+    arrays["route_short_name"] = encode_ids(routes["route_short_name"].fillna(""))
+
+    stop_ids = np.unique(encode_ids(stops["stop_id"]))
+    stops = stops.set_index(encode_ids(stops["stop_id"])).loc[stop_ids]
+    arrays["stop_ids"] = stop_ids
+    arrays["stop_name"] = encode_ids(stops["stop_name"].fillna(""))
+    for col in ("lon", "lat", "x", "y"):
+        arrays[f"stop_{col}"] = stops[col].to_numpy(dtype=np.float64)
+
+    # El ORDER BY de PostgreSQL depende de la collation: se reordena por codigo,
+    # de forma estable para mantener el orden de los puntos dentro de cada shape
+    shape_ids = np.unique(encode_ids(shapes["shape_id"]))
+    shape_code = intern(shape_ids, shapes["shape_id"])
+    order = np.argsort(shape_code, kind="stable")
+    arrays["shape_ids"] = shape_ids
+    arrays["shape_offsets"] = csr_offsets(shape_code, len(shape_ids))
+    arrays["shape_x"] = shapes["x"].to_numpy(dtype=np.float64)[order]
+    arrays["shape_y"] = shapes["y"].to_numpy(dtype=np.float64)[order]
+
+    trip_ids = np.unique(encode_ids(trips["trip_id"]))
+    trips = trips.set_index(encode_ids(trips["trip_id"])).loc[trip_ids]
+    arrays["trip_ids"] = trip_ids
+    arrays["trip_route"] = intern(route_ids, trips["route_id"])
+    arrays["trip_shape"] = intern(shape_ids, trips["shape_id"].fillna(""))
+    arrays["trip_direction"] = (
+        pd.to_numeric(trips["direction_id"], errors="coerce").fillna(-1).to_numpy(dtype=np.int8)
+    )
+
+    # Se descartan las filas de trips desconocidos y se agrupan por codigo de trip
+    st_trip = intern(trip_ids, stop_times["trip_id"])
+    order = np.flatnonzero(st_trip >= 0)
+    order = order[np.argsort(st_trip[order], kind="stable")]
+    stop_times = stop_times.iloc[order]
+    arrays["stop_offsets"] = csr_offsets(st_trip[order], len(trip_ids))
+    arrays["st_stop"] = intern(stop_ids, stop_times["stop_id"])
+    arrays["st_sequence"] = stop_times["stop_sequence"].to_numpy(dtype=np.int32)
+    arrays["st_arrival"] = stop_times["arrival"].fillna(-1).to_numpy(dtype=np.int32)
+    arrays["st_departure"] = stop_times["departure"].fillna(-1).to_numpy(dtype=np.int32)
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    meta = {
+        "version": STORE_VERSION,
+        "built_at": time.time(),
+        "trips": len(trip_ids),
+        "stop_times": int(len(stop_times)),
+        "shape_points": int(len(shapes)),
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class ScheduleStore:
+    """
+    Read-only view of a store built by build_store(). Every array is
+    memory-mapped, so opening it is immediate and processes reading the same
+    directory share one copy through the page cache. Trip attributes are
+    looked up by trip index in O(1); ids are resolved with a binary search.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(
+                f"Schedule store version {self.meta['version']} is not supported, rebuild it"
+            )
+        for name in STORE_ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+
+    def trip_index(self, trip_id):
+        """Index of the trip, or -1 if it is not in the schedule."""
+        return int(intern(self.trip_ids, [trip_id])[0])
+
+    def trip_indices(self, trip_ids):
+        return intern(self.trip_ids, trip_ids)
+
+    def trip_route_id(self, trip):
+        return self.route_ids[self.trip_route[trip]].decode()
+
+    def trip_route_type(self, trip):
+        return int(self.route_type[self.trip_route[trip]])
+
+    def trip_route_types(self, trip_ids):
+        """Route type of each trip id as a string, None for unknown trips."""
+        trips = self.trip_indices(trip_ids)
+        routes = np.where(trips >= 0, self.trip_route[np.maximum(trips, 0)], -1)
+        types = self.route_type[np.maximum(routes, 0)]
+        return [str(t) if route >= 0 else None for route, t in zip(routes, types)]
+
+    def trip_shape_id(self, trip):
+        shape = self.trip_shape[trip]
+        return self.shape_ids[shape].decode() if shape >= 0 else None
+
+    def trip_shape_points(self, trip):
+        """(x, y) of the trip's shape in EPSG:5514, as views over the mapped arrays."""
+        shape = self.trip_shape[trip]
+        if shape < 0:
+            return None
+        start, end = self.shape_offsets[shape], self.shape_offsets[shape + 1]
+        return self.shape_x[start:end], self.shape_y[start:end]
+
+    def trip_stop_rows(self, trip):
+        start, end = self.stop_offsets[trip], self.stop_offsets[trip + 1]
+        return slice(start, end)
+
+    def trip_stops(self, trip):
+        """Stop ids of the trip in stop_sequence order."""
+        return [self.stop_ids[s].decode() for s in self.st_stop[self.trip_stop_rows(trip)]]
+
+    def trip_stop_times(self, trip):
+        """Stop times of the trip as a DataFrame, with times in seconds of the service day."""
+        rows = self.trip_stop_rows(trip)
+        stops = self.st_stop[rows]
+        return pd.DataFrame(
+            {
+                "stop_sequence": self.st_sequence[rows],
+                "stop_id": np.char.decode(self.stop_ids[stops], "utf-8"),
+                "arrival": self.st_arrival[rows],
+                "departure": self.st_departure[rows],
+                "x": self.stop_x[stops],
+                "y": self.stop_y[stops],
+            }
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the GTFS schedule from PostgreSQL into a memory-mapped store."
+    )
+    parser.add_argument("directory", nargs="?", default=DEFAULT_STORE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    meta = build_store(args.directory)
+    print(
+        f"{meta['trips']} trips, {meta['stop_times']} stop times and "
+        f"{meta['shape_points']} shape points saved to {args.directory} "
+        f"in {time.perf_counter() - start:.1f} s"
+    )
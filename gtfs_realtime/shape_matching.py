@@ -0,0 +1,143 @@
+import numpy as np
+import psycopg2
+import shapely
+from psycopg2 import sql
+from pyproj import Transformer
+from shapely import wkb
+from shapely.ops import substring
+
+# Database configuration
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "prague",
+    "user": "postgres",
+    "port": "25432",
+}
+
+# Las distancias se miden en S-JTSK (metros), igual que en las consultas SQL
+METRIC_CRS = "EPSG:5514"
+# Distancia maxima (m) de un punto a la shape para aceptar el snap sin Valhalla
+SNAP_MAX_DISTANCE = 30
+# Retroceso maximo (m) a lo largo de la shape entre puntos consecutivos, por ruido del GPS.
+# Un retroceso mayor indica que el snap eligio el otro paso de una shape con lazos
+SNAP_MAX_BACKTRACK = 15
+
+to_metric = Transformer.from_crs("EPSG:4326", METRIC_CRS, always_xy=True)
+to_wgs84 = Transformer.from_crs(METRIC_CRS, "EPSG:4326", always_xy=True)
+
+
+def load_trip_shapes(trip_ids, batch_size=1000, store=None):
+    """
+    Fetches the scheduled GTFS shape of each trip from PostgreSQL, or from a
+    schedule_store.ScheduleStore when one is given.
+    Returns a dict trip_id -> LineString in METRIC_CRS; trips sharing a
+    shape share the same geometry object.
+    """
+    if store is not None:
+        return load_store_shapes(trip_ids, store)
+
+    trip_shape_ids = {}
+    shapes = {}
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    for i in range(0, len(trip_ids), batch_size):
+        batch = trip_ids[i : i + batch_size]
+        cursor.execute(
+            sql.SQL(
+                "SELECT trip_id, shape_id FROM trips WHERE trip_id IN ({})"
+            ).format(sql.SQL(",").join(map(sql.Literal, batch)))
+        )
+        trip_shape_ids.update(
+            (trip_id, shape_id) for trip_id, shape_id in cursor.fetchall() if shape_id
+        )
+
+    shape_ids = sorted(set(trip_shape_ids.values()))
+    for i in range(0, len(shape_ids), batch_size):
+        batch = shape_ids[i : i + batch_size]
+        cursor.execute(
+            sql.SQL(
+                """
+                SELECT shape_id,
+                       ST_AsBinary(ST_Transform(
+                           ST_MakeLine(shape_pt_loc::geometry ORDER BY shape_pt_sequence),
+                           5514
+                       ))
+                FROM shapes
+                WHERE shape_id IN ({})
+                GROUP BY shape_id
+                """
+            ).format(sql.SQL(",").join(map(sql.Literal, batch)))
+        )
+        for shape_id, geom in cursor.fetchall():
+            line = wkb.loads(bytes(geom))
+            shapely.prepare(line)
+            shapes[shape_id] = line
+    conn.close()
+
+    return {
+        trip_id: shapes[shape_id]
+        for trip_id, shape_id in trip_shape_ids.items()
+        if shape_id in shapes
+    }
+
+
+def load_store_shapes(trip_ids, store):
+    trips = store.trip_indices(trip_ids)
+    shapes = {}
+    trip_shapes = {}
+    for trip_id, trip in zip(trip_ids, trips):
+        if trip < 0 or store.trip_shape[trip] < 0:
+            continue
+        shape = store.trip_shape[trip]
+        if shape not in shapes:
+            x, y = store.trip_shape_points(trip)
+            if len(x) < 2:
+                continue
+            line = shapely.linestrings(x, y)
+            shapely.prepare(line)
+            shapes[shape] = line
+        trip_shapes[trip_id] = shapes[shape]
+    return trip_shapes
+
+
+def snap_to_shape(points, line, max_distance=SNAP_MAX_DISTANCE, max_backtrack=SNAP_MAX_BACKTRACK):
+    """
+    Projects the time-ordered points of a trip onto its scheduled shape.
+    Returns a (matched, shape pieces) pair like each part of
+    map_matching.map_match_trip, or (None, None) if any point lies further
+    than `max_distance` meters from the shape or the projections move back
+    along it by more than `max_backtrack` meters (loops, shapes that pass the
+    same place twice).
+    """
+    if len(points) < 2:
+        return None, None
+
+    lon = np.array([p["lon"] for p in points], dtype=float)
+    lat = np.array([p["lat"] for p in points], dtype=float)
+    x, y = to_metric.transform(lon, lat)
+    observed = shapely.points(x, y)
+
+    along = shapely.line_locate_point(line, observed)
+    snapped = shapely.line_interpolate_point(line, along)
+    if shapely.distance(observed, snapped).max() > max_distance:
+        return None, None
+    if along.max() <= along.min():
+        return None, None
+    if np.diff(along).min() < -max_backtrack:
+        return None, None
+
+    snapped_lon, snapped_lat = to_wgs84.transform(
+        shapely.get_x(snapped), shapely.get_y(snapped)
+    )
+    matched = [
+        (snapped_lon[i], snapped_lat[i], points[i]["time"]) for i in range(len(points))
+    ]
+
+    # Tramo de la shape recorrido durante el trip, como pieza de shape en (lat, lon)
+    travelled = substring(line, along.min(), along.max())
+    coords = shapely.get_coordinates(travelled)
+    shape_lon, shape_lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+    shape = list(zip(shape_lat, shape_lon))
+
+    return matched, [(shape, None, None)]
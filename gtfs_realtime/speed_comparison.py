@@ -1,35 +1,31 @@
-import psycopg2
+import argparse
 import matplotlib.pyplot as plt
 import numpy as np
 import matplotlib.colors as mcolors
+from speed_profiles import DEFAULT_CACHE, SpeedProfiles
 
-conn_params = {
-    "host": "localhost",
-    "dbname": "prague",
-    "user": "postgres",
-    "password": "",  # si aplica
-    "port": 25432,
-}
-
-sql = """
-SELECT
-  CONCAT(
-    FLOOR(diff / 5) * 5, ' to ', FLOOR(diff / 5) * 5 + 5
-  ) AS speed_diff_range,
-  COUNT(*) AS segment_count
-FROM trip_speeds_diffs
-GROUP BY speed_diff_range
-ORDER BY MIN(FLOOR(diff / 5) * 5);
-"""
+
+def speed_diff_ranges(profiles):
+    """
+    Segment counts by observed - scheduled speed difference in 5 km/h ranges,
+    computed from the precomputed profiles instead of trip_speeds_diffs.
+    """
+    diffs = profiles.speed_diffs()
+    starts = (np.floor(diffs / 5) * 5).astype(int)
+    counts = starts.value_counts().sort_index()
+    return [(f"{start} to {start + 5}", count) for start, count in counts.items()]
 
 
 def main():
-    conn = psycopg2.connect(**conn_params)
-    cur = conn.cursor()
-    cur.execute(sql)
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
+    parser = argparse.ArgumentParser(
+        description="Plot segments by speed difference range."
+    )
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--refresh", action="store_true", help="Reload the speed profiles from the database")
+    parser.add_argument("--parquet", help="Read segment_speed_profiles.parquet instead of the database")
+    args = parser.parse_args()
+
+    results = speed_diff_ranges(SpeedProfiles.cached(args.cache, args.refresh, args.parquet))
 
     labels = [row[0] for row in results]
     counts = np.array([row[1] for row in results])
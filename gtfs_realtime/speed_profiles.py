@@ -0,0 +1,195 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+conn_params = {
+    "host": "localhost",
+    "dbname": "prague",
+    "user": "postgres",
+    "password": "",  # si aplica
+    "port": 25432,
+}
+
+# Deben coincidir con los bins usados en speed_profiles.sql
+BIN_WIDTH = 2
+NUM_BINS = 60
+DEFAULT_CACHE = "speed_profiles.npz"
+
+KEY_COLUMNS = ["stop1_id", "stop2_id", "hour_bucket", "route_type", "kind"]
+
+sql = """
+SELECT stop1_id, stop2_id, hour_bucket, route_type, kind,
+       n, speed_sum, speed_min, speed_max, bins, counts
+FROM segment_speed_profiles;
+"""
+
+
+class SpeedProfiles:
+    """
+    In-memory view of segment_speed_profiles: one dense histogram row per
+    (segment, hour, route type, kind), filtered and aggregated with numpy.
+    """
+
+    def __init__(self, keys, histograms, n, speed_sum, speed_min, speed_max):
+        self.keys = keys.reset_index(drop=True)
+        self.histograms = histograms
+        self.n = n
+        self.speed_sum = speed_sum
+        self.speed_min = speed_min
+        self.speed_max = speed_max
+        self.segment_code, self.segments = pd.MultiIndex.from_frame(
+            self.keys[["stop1_id", "stop2_id"]]
+        ).factorize()
+        self.hours = self.keys["hour_bucket"].to_numpy()
+        self.route_types = self.keys["route_type"].to_numpy()
+        self.kinds = self.keys["kind"].to_numpy()
+
+    @classmethod
+    def from_db(cls):
+        conn = psycopg2.connect(**conn_params)
+        cur = conn.cursor()
+        cur.execute(sql)
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return cls.from_rows(rows)
+
+    @classmethod
+    def from_parquet(cls, path):
+        """Reads segment_speed_profiles.parquet from offline/duckdb_pipeline.py."""
+        df = pd.read_parquet(path)
+        return cls.from_rows(list(df.itertuples(index=False, name=None)))
+
+    @classmethod
+    def from_rows(cls, rows):
+        keys = pd.DataFrame([row[:5] for row in rows], columns=KEY_COLUMNS)
+        histograms = np.zeros((len(rows), NUM_BINS), dtype=np.int32)
+        for i, row in enumerate(rows):
+            histograms[i, row[9]] = row[10]
+        stats = np.array([row[5:9] for row in rows], dtype=np.float64).reshape(-1, 4)
+        return cls(keys, histograms, *stats.T)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            **{col: self.keys[col].to_numpy().astype(str) for col in KEY_COLUMNS},
+            histograms=self.histograms,
+            n=self.n,
+            speed_sum=self.speed_sum,
+            speed_min=self.speed_min,
+            speed_max=self.speed_max,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        keys = pd.DataFrame({col: data[col] for col in KEY_COLUMNS})
+        keys["hour_bucket"] = keys["hour_bucket"].astype(int)
+        return cls(
+            keys,
+            data["histograms"],
+            data["n"],
+            data["speed_sum"],
+            data["speed_min"],
+            data["speed_max"],
+        )
+
+    @classmethod
+    def cached(cls, path=DEFAULT_CACHE, refresh=False, parquet=None):
+        """
+        Loads the profiles from a local cache, fetching them once from the
+        database or from the offline pipeline's Parquet output.
+        """
+        if os.path.exists(path) and not refresh:
+            return cls.load(path)
+        profiles = cls.from_parquet(parquet) if parquet else cls.from_db()
+        profiles.save(path)
+        return profiles
+
+    def mask(self, kind="scheduled", hours=None, route_types=None):
+        """
+        Rows of the given kind, optionally limited to an hour range
+        (start, end) with end exclusive, and to a set of route types.
+        """
+        selected = self.kinds == kind
+        if hours is not None:
+            start, end = hours
+            if start <= end:
+                selected &= (self.hours >= start) & (self.hours < end)
+            else:
+                selected &= (self.hours >= start) | (self.hours < end)
+        if route_types is not None:
+            selected &= np.isin(self.route_types, list(route_types))
+        return selected
+
+    def histogram(self, kind="scheduled", hours=None, route_types=None):
+        """Aggregated speed histogram as a Series indexed by the bin's lower bound."""
+        counts = self.histograms[self.mask(kind, hours, route_types)].sum(axis=0)
+        return pd.Series(counts, index=np.arange(NUM_BINS) * BIN_WIDTH, name="count")
+
+    def percentile(self, q, kind="scheduled", hours=None, route_types=None):
+        """Speed percentile (0-100), interpolated linearly inside the bin."""
+        counts = self.histogram(kind, hours, route_types).to_numpy()
+        total = counts.sum()
+        if total == 0:
+            return None
+        cumulative = np.cumsum(counts)
+        target = q / 100 * total
+        b = int(np.searchsorted(cumulative, target, side="left"))
+        b = min(b, NUM_BINS - 1)
+        before = cumulative[b - 1] if b > 0 else 0
+        inside = (target - before) / counts[b] if counts[b] else 0
+        return (b + inside) * BIN_WIDTH
+
+    def segment_means(self, kind="scheduled", hours=None, route_types=None):
+        """Mean speed per segment over the selected rows."""
+        selected = self.mask(kind, hours, route_types)
+        codes = self.segment_code[selected]
+        size = len(self.segments)
+        n = np.bincount(codes, weights=self.n[selected], minlength=size)
+        total = np.bincount(codes, weights=self.speed_sum[selected], minlength=size)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = total / n
+        return pd.Series(means, index=self.segments, name="speed_kmh").dropna()
+
+    def segments_over(self, threshold_kmh, kind="scheduled", hours=None, route_types=None):
+        """Segments whose mean speed exceeds the threshold (e.g. 50 km/h outliers)."""
+        means = self.segment_means(kind, hours, route_types)
+        return means[means > threshold_kmh]
+
+    def speed_diffs(self, hours=None, route_types=None):
+        """
+        Observed minus scheduled mean speed per segment. As in trip_speeds_diffs,
+        the scheduled side only counts trips whose shape was observed on the
+        segment, not every trip scheduled over the stop pair.
+        """
+        if not (self.kinds == "scheduled_observed").any() and (self.kinds == "observed").any():
+            raise ValueError(
+                "Profiles without 'scheduled_observed' rows: re-run speed_profiles.sql and refresh the cache"
+            )
+        observed = self.segment_means("observed", hours, route_types)
+        scheduled = self.segment_means("scheduled_observed", hours, route_types)
+        return (observed - scheduled).dropna().rename("diff")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the precomputed segment speed profiles."
+    )
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--refresh", action="store_true", help="Reload the cache from the database")
+    parser.add_argument("--parquet", help="Read segment_speed_profiles.parquet instead of the database")
+    parser.add_argument("--kind", default="scheduled", choices=["scheduled", "observed", "scheduled_observed"])
+    parser.add_argument("--hours", nargs=2, type=int, metavar=("START", "END"))
+    parser.add_argument("--route-types", nargs="+")
+    parser.add_argument("--over", type=float, default=50, help="Speed threshold in km/h")
+    args = parser.parse_args()
+
+    profiles = SpeedProfiles.cached(args.cache, args.refresh, args.parquet)
+    filters = dict(kind=args.kind, hours=args.hours, route_types=args.route_types)
+    for q in (50, 85, 95):
+        print(f"p{q}: {profiles.percentile(q, **filters)} km/h")
+    print(f"Segments over {args.over} km/h: {len(profiles.segments_over(args.over, **filters))}")
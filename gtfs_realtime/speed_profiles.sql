@@ -0,0 +1,122 @@
+-- Perfiles de velocidad precalculados por segmento (par de paradas), hora del dia y tipo de ruta.
+-- Cada fila guarda un histograma disperso de velocidades (bins de 2 km/h, el ultimo acumula >= 118 km/h)
+-- junto con la cantidad, suma, minimo y maximo, para velocidades programadas y observadas
+-- (y programadas de las shapes con observaciones, para las diferencias).
+-- Requiere trip_segs (mdb_importer_scheduled.sql) y trip_segments_rt (queries.sql).
+
+-- stage: segment_speed_samples
+DROP TABLE IF EXISTS segment_speed_samples;
+CREATE TEMP TABLE segment_speed_samples AS
+SELECT
+    s.stop1_id,
+    s.stop2_id,
+    (EXTRACT(HOUR FROM s.stop1_arrival_time)::int % 24) AS hour_bucket,
+    r.route_type,
+    'scheduled'::text AS kind,
+    s.seg_length / EXTRACT(EPOCH FROM (s.stop2_arrival_time - s.stop1_arrival_time)) * 3.6 AS speed_kmh
+FROM trip_segs s
+JOIN routes r USING (route_id)
+WHERE s.stop2_arrival_time > s.stop1_arrival_time
+  AND s.seg_length IS NOT NULL;
+
+-- Un solo largo por segmento de shape, para no multiplicar cada pasada real por la cantidad de trips programados
+INSERT INTO segment_speed_samples
+WITH seg_lengths AS (
+    SELECT DISTINCT ON (shape_id, stop1_id, stop2_id)
+        shape_id, stop1_id, stop2_id, route_id, seg_length
+    FROM trip_segs
+    WHERE seg_length IS NOT NULL
+)
+SELECT
+    t.start_stop_id,
+    t.end_stop_id,
+    EXTRACT(HOUR FROM t.start_time_actual AT TIME ZONE 'Europe/Prague')::int,
+    r.route_type,
+    'observed',
+    l.seg_length / EXTRACT(EPOCH FROM (t.end_time_actual - t.start_time_actual)) * 3.6
+FROM trip_segments_rt t
+JOIN seg_lengths l
+  ON l.shape_id = t.shape_id
+ AND l.stop1_id = t.start_stop_id
+ AND l.stop2_id = t.end_stop_id
+JOIN routes r ON r.route_id = l.route_id
+WHERE t.start_time_actual IS NOT NULL
+  AND t.end_time_actual > t.start_time_actual;
+
+-- Velocidades programadas solo de las shapes con pasadas observadas en el segmento, para que la
+-- diferencia observada - programada compare los mismos recorridos, como trip_speeds_diffs (queries.sql)
+INSERT INTO segment_speed_samples
+SELECT
+    s.stop1_id,
+    s.stop2_id,
+    (EXTRACT(HOUR FROM s.stop1_arrival_time)::int % 24),
+    r.route_type,
+    'scheduled_observed',
+    s.seg_length / EXTRACT(EPOCH FROM (s.stop2_arrival_time - s.stop1_arrival_time)) * 3.6
+FROM trip_segs s
+JOIN routes r USING (route_id)
+WHERE s.stop2_arrival_time > s.stop1_arrival_time
+  AND s.seg_length IS NOT NULL
+  AND EXISTS (
+      SELECT 1
+      FROM trip_segments_rt t
+      WHERE t.shape_id = s.shape_id
+        AND t.start_stop_id = s.stop1_id
+        AND t.end_stop_id = s.stop2_id
+        AND t.start_time_actual IS NOT NULL
+        AND t.end_time_actual > t.start_time_actual
+  );
+
+-- stage: segment_speed_profiles
+DROP TABLE IF EXISTS segment_speed_profiles;
+CREATE TABLE segment_speed_profiles (
+  stop1_id text,
+  stop2_id text,
+  hour_bucket integer,
+  route_type text,
+  kind text,
+  n integer,
+  speed_sum float,
+  speed_min float,
+  speed_max float,
+  bins smallint[],
+  counts integer[],
+  PRIMARY KEY (stop1_id, stop2_id, hour_bucket, route_type, kind)
+);
+
+INSERT INTO segment_speed_profiles
+WITH binned AS (
+    SELECT
+        stop1_id, stop2_id, hour_bucket, route_type, kind,
+        LEAST(FLOOR(speed_kmh / 2)::int, 59) AS bin,
+        COUNT(*) AS c,
+        SUM(speed_kmh) AS s,
+        MIN(speed_kmh) AS mn,
+        MAX(speed_kmh) AS mx
+    FROM segment_speed_samples
+    GROUP BY stop1_id, stop2_id, hour_bucket, route_type, kind, bin
+)
+SELECT
+    stop1_id, stop2_id, hour_bucket, route_type, kind,
+    SUM(c),
+    SUM(s),
+    MIN(mn),
+    MAX(mx),
+    array_agg(bin::smallint ORDER BY bin),
+    array_agg(c::int ORDER BY bin)
+FROM binned
+GROUP BY stop1_id, stop2_id, hour_bucket, route_type, kind;
+
+-- stage: speed_profile_segments
+-- Geometria de cada segmento, para las capas de mapas
+DROP TABLE IF EXISTS speed_profile_segments;
+CREATE TABLE speed_profile_segments AS
+SELECT DISTINCT ON (stop1_id, stop2_id)
+    stop1_id,
+    stop2_id,
+    seg_geom
+FROM trip_segs
+WHERE seg_geom IS NOT NULL;
+
+ALTER TABLE speed_profile_segments ADD PRIMARY KEY (stop1_id, stop2_id);
+CREATE INDEX IF NOT EXISTS idx_speed_profile_segments_geom ON speed_profile_segments USING GIST (seg_geom);
@@ -1,38 +1,158 @@
+import argparse
+import io
+import os
 import psycopg2
+import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 
 DB_HOST = "localhost"
 DB_PORT = 25432
 DB_NAME = "prague"
 DB_USER = "postgres"
-DB_PASS = ""  
+DB_PASS = ""
 
-# Query the SegmentsDisplay table
-query = "SELECT num_routes FROM SegmentsDisplay;"
+DEFAULT_CACHE = "route_overlap.npz"
 
-def fetch_num_routes():
-    conn = psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, dbname=DB_NAME,
-        user=DB_USER, password=DB_PASS
-    )
-    cur = conn.cursor()
-    cur.execute(query)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    # Flatten to 1D list
-    return [row[0] for row in data]
-
-def plot_histogram(num_routes_list):
+# Cubo de route_overlap.sql: que rutas pasan por cada segmento, por fecha, tipo de ruta y hora
+query = """
+COPY (
+    SELECT date, route_type, hour, segment_id, route_code
+    FROM route_segment_hours
+) TO STDOUT WITH CSV HEADER
+"""
+
+
+class RouteOverlapCube:
+    """
+    route_segment_hours in flat numpy arrays. The distinct routes of any
+    window are counted from the (segment, route) pairs of its hours.
+    """
+
+    def __init__(self, dates, route_types, hours, segment_ids, route_codes):
+        self.dates = dates
+        self.route_types = route_types
+        self.hours = hours
+        self.segment_ids = segment_ids
+        self.route_codes = route_codes
+
+    @classmethod
+    def from_db(cls):
+        conn = psycopg2.connect(
+            host=DB_HOST, port=DB_PORT, dbname=DB_NAME,
+            user=DB_USER, password=DB_PASS
+        )
+        cur = conn.cursor()
+        buffer = io.StringIO()
+        cur.copy_expert(query, buffer)
+        cur.close()
+        conn.close()
+        buffer.seek(0)
+        return cls.from_frame(pd.read_csv(buffer, dtype={"route_type": str}))
+
+    @classmethod
+    def from_parquet(cls, path):
+        """Reads route_segment_hours.parquet from offline/duckdb_pipeline.py."""
+        return cls.from_frame(pd.read_parquet(path))
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(
+            df["date"].to_numpy(dtype="datetime64[D]"),
+            df["route_type"].to_numpy(dtype=str),
+            df["hour"].to_numpy(dtype=np.int16),
+            df["segment_id"].to_numpy(dtype=np.int32),
+            df["route_code"].to_numpy(dtype=np.int16),
+        )
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            dates=self.dates,
+            route_types=self.route_types,
+            hours=self.hours,
+            segment_ids=self.segment_ids,
+            route_codes=self.route_codes,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(
+            data["dates"],
+            data["route_types"],
+            data["hours"],
+            data["segment_ids"],
+            data["route_codes"],
+        )
+
+    @classmethod
+    def cached(cls, path=DEFAULT_CACHE, refresh=False, parquet=None):
+        """
+        Loads the cube from a local cache, fetching it once from the database
+        or from the offline pipeline's Parquet output.
+        """
+        if os.path.exists(path) and not refresh:
+            return cls.load(path)
+        cube = cls.from_parquet(parquet) if parquet else cls.from_db()
+        cube.save(path)
+        return cube
+
+    def num_routes(self, date=None, route_types=None, start_hour=0, end_hour=None):
+        """
+        Distinct routes per segment in the window [start_hour, end_hour), as a
+        Series indexed by segment_id. Segments without routes are left out.
+        """
+        selected = self.hours >= start_hour
+        if end_hour is not None:
+            selected &= self.hours < end_hour
+        if date is not None:
+            selected &= self.dates == np.datetime64(date, "D")
+        if route_types is not None:
+            selected &= np.isin(self.route_types, list(route_types))
+        # Cada par (segmento, ruta) se cuenta una sola vez aunque aparezca en varias horas
+        pairs = np.unique(
+            self.segment_ids[selected].astype(np.int64) << 16
+            | self.route_codes[selected].astype(np.int64)
+        )
+        segments, counts = np.unique(pairs >> 16, return_counts=True)
+        return pd.Series(counts, index=pd.Index(segments, name="segment_id"), name="num_routes")
+
+
+def fetch_num_routes(date="2025-07-08", route_types=("3",), start_hour=15, end_hour=17, cache=DEFAULT_CACHE, refresh=False, parquet=None):
+    cube = RouteOverlapCube.cached(cache, refresh, parquet)
+    return cube.num_routes(date, route_types, start_hour, end_hour).tolist()
+
+def plot_histogram(num_routes_list, title='Histogram of Number of Routes per Segment'):
     plt.figure(figsize=(10,6))
     plt.hist(num_routes_list, bins=30, color="#3794eb", edgecolor="black")
     plt.xlabel('Number of Routes per Segment')
     plt.ylabel('Count of Segments')
-    plt.title('Histogram of Number of Routes per Segment')
+    plt.title(title)
     plt.grid(axis='y', alpha=0.5)
     plt.tight_layout()
     plt.show()
 
 if __name__ == "__main__":
-    num_routes_list = fetch_num_routes()
-    plot_histogram(num_routes_list)
+    parser = argparse.ArgumentParser(
+        description="Histogram of the number of routes per segment in a time window."
+    )
+    parser.add_argument("--date", default="2025-07-08", help="Service date, or 'all'")
+    parser.add_argument("--route-types", nargs="+", default=["3"], help="Route types, or 'all'")
+    parser.add_argument("--start-hour", type=int, default=15)
+    parser.add_argument("--end-hour", type=int, default=17, help="Exclusive; service hours can exceed 24")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--refresh", action="store_true", help="Reload the cube from the database")
+    parser.add_argument("--parquet", help="Read route_segment_hours.parquet instead of the database")
+    args = parser.parse_args()
+
+    date = None if args.date == "all" else args.date
+    route_types = None if args.route_types == ["all"] else args.route_types
+    num_routes_list = fetch_num_routes(
+        date, route_types, args.start_hour, args.end_hour, args.cache, args.refresh, args.parquet
+    )
+    plot_histogram(
+        num_routes_list,
+        f"Routes per Segment ({args.date}, types {', '.join(args.route_types)}, "
+        f"{args.start_hour:02d}:00-{args.end_hour:02d}:00)",
+    )
@@ -1,5 +1,6 @@
 -- Inspired in: https://github.dev/pabloito/MDB-Importer
 
+-- stage: insert_trip_stops
 -- Crear trip_stops
 DROP TABLE IF EXISTS trip_stops;
 CREATE TABLE trip_stops (
@@ -25,6 +26,7 @@ BEGIN
 END;
 $$;
 
+-- stage: update_trip_stops_perc
 DO $$
 BEGIN
   RAISE NOTICE '...Updating trip_stops';
@@ -40,6 +42,7 @@ BEGIN
 END;
 $$;
 
+-- stage: insert_trip_segs
 -- Crear trip_segs
 DROP TABLE IF EXISTS trip_segs CASCADE;
 CREATE TABLE trip_segs (
@@ -82,6 +85,7 @@ BEGIN
 END;
 $$;
 
+-- stage: update_trip_segs_geom
 DO $$
 BEGIN
   RAISE NOTICE '...Updating trip_segs';
@@ -95,6 +99,7 @@ BEGIN
 END;
 $$;
 
+-- stage: delete_trip_segs_without_geom
 DELETE FROM trip_segs
 WHERE trip_id IN (
   SELECT trip_id
@@ -103,6 +108,7 @@ WHERE trip_id IN (
 );
 -- 5963 trips (7.8% aprox)
 
+-- stage: update_trip_segs_length
 DO $$
 BEGIN
   RAISE NOTICE '...Updating trip_segs 2';
@@ -111,6 +117,7 @@ BEGIN
 END;
 $$;
 
+-- stage: insert_trip_points
 -- Crear trip_points
 DROP TABLE IF EXISTS trip_points;
 CREATE TABLE trip_points (
@@ -160,6 +167,7 @@ BEGIN
 END;
 $$;
 
+-- stage: insert_trips_input
 DROP TABLE IF EXISTS trips_input;
 CREATE TABLE trips_input (
   trip_id text,
@@ -186,7 +194,10 @@ END;
 $$;
 
 
+-- stage: insert_trips_mdb
 DROP TABLE IF EXISTS trips_mdb CASCADE;
+-- El indice de poi_proximity.sql se calcula sobre trips_mdb: se descarta para que se recalcule completo
+DROP TABLE IF EXISTS poi_proximity, poi_proximity_done;
 CREATE TABLE trips_mdb (
   trip_id text NOT NULL,
   route_id text NOT NULL,
@@ -209,6 +220,7 @@ BEGIN
 END;
 $$;
 
+-- stage: update_trips_mdb
 ALTER TABLE trips_mdb ADD COLUMN traj geometry;
 ALTER TABLE trips_mdb ADD COLUMN starttime timestamp;
 
@@ -0,0 +1,84 @@
+-- Indice de proximidad espacio-temporal entre trips y puntos de interes (POIs).
+-- Para cada POI y cada radio se guardan los intervalos de tiempo en los que cada trip
+-- esta dentro del radio, calculados con whenTrue(tDwithin(...)) sobre el tgeompoint
+-- en lugar de expandir todos los instantes del trip.
+-- Es incremental: solo se calculan los pares (POI, radio) que todavia no estan en poi_proximity,
+-- asi que para agregar POIs o radios basta con insertarlos en pois / poi_radii y volver a correrlo.
+-- mdb_importer_scheduled.sql descarta poi_proximity y poi_proximity_done al reconstruir trips_mdb,
+-- por lo que despues de reimportar el horario hay que volver a correr este script.
+-- Requiere trips_mdb (mdb_importer_scheduled.sql) y shopping_malls.
+
+-- stage: pois
+CREATE TABLE IF NOT EXISTS pois (
+  poi_id serial PRIMARY KEY,
+  category text NOT NULL,
+  name text NOT NULL,
+  geom geometry NOT NULL, -- EPSG:5514, igual que trips_mdb.traj
+  UNIQUE (category, name)
+);
+CREATE INDEX IF NOT EXISTS idx_pois_geom ON pois USING GIST (geom);
+
+INSERT INTO pois (category, name, geom)
+SELECT 'shopping', name, geom
+FROM shopping_malls
+ON CONFLICT (category, name) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS poi_radii (
+  radius integer PRIMARY KEY
+);
+
+INSERT INTO poi_radii (radius)
+VALUES (100), (200), (500)
+ON CONFLICT (radius) DO NOTHING;
+
+-- stage: poi_proximity
+CREATE INDEX IF NOT EXISTS idx_trips_mdb_traj ON trips_mdb USING GIST (traj);
+
+CREATE TABLE IF NOT EXISTS poi_proximity (
+  poi_id integer NOT NULL REFERENCES pois (poi_id) ON DELETE CASCADE,
+  radius integer NOT NULL,
+  trip_id text NOT NULL,
+  route_id text NOT NULL,
+  date date NOT NULL,
+  during tstzrange NOT NULL
+);
+
+-- Pares (POI, radio) ya calculados, para no repetirlos
+CREATE TABLE IF NOT EXISTS poi_proximity_done (
+  poi_id integer NOT NULL REFERENCES pois (poi_id) ON DELETE CASCADE,
+  radius integer NOT NULL,
+  PRIMARY KEY (poi_id, radius)
+);
+
+CREATE TEMP TABLE pending_poi_radii AS
+SELECT p.poi_id, p.geom, r.radius
+FROM pois p
+CROSS JOIN poi_radii r
+WHERE NOT EXISTS (
+  SELECT 1 FROM poi_proximity_done d
+  WHERE d.poi_id = p.poi_id AND d.radius = r.radius
+);
+
+-- El ST_DWithin sobre traj usa idx_trips_mdb_traj para descartar los trips lejanos;
+-- solo a los candidatos se les calcula el tiempo exacto dentro del radio
+INSERT INTO poi_proximity (poi_id, radius, trip_id, route_id, date, during)
+SELECT
+  pr.poi_id,
+  pr.radius,
+  t.trip_id,
+  t.route_id,
+  t.date,
+  tstzrange(lower(sp), upper(sp), '[]')
+FROM pending_poi_radii pr
+JOIN trips_mdb t ON ST_DWithin(pr.geom, t.traj, pr.radius)
+CROSS JOIN LATERAL unnest(spans(whenTrue(tDwithin(t.trip, pr.geom, pr.radius)))) AS sp;
+
+INSERT INTO poi_proximity_done (poi_id, radius)
+SELECT poi_id, radius FROM pending_poi_radii;
+
+DROP TABLE pending_poi_radii;
+
+-- stage: poi_proximity_indexes
+CREATE INDEX IF NOT EXISTS idx_poi_proximity_during ON poi_proximity USING GIST (during);
+CREATE INDEX IF NOT EXISTS idx_poi_proximity_poi_radius ON poi_proximity (poi_id, radius);
+ANALYZE poi_proximity;
@@ -38,31 +38,23 @@ SELECT ROW_NUMBER() OVER () as id, trip_id, ST_GeometryType(ST_Intersection(traj
 
 
 -- Agregacion de rutas por segmento
+-- Ventana puntual sobre el cubo de route_overlap.sql (las horas van de 15 a 17, sin incluir las 17)
 DROP MATERIALIZED VIEW IF EXISTS SegmentsDisplay;
 CREATE MATERIALIZED VIEW SegmentsDisplay AS
 SELECT
-    c.from_stop_id || c.to_stop_id as id,
-    s.seg_geom,
-    COUNT(DISTINCT c.route_id) AS num_routes
+    seg.stop1_id || seg.stop2_id as id,
+    seg.segment_id,
+    seg.seg_geom,
+    COUNT(DISTINCT h.route_code) AS num_routes
 FROM
-    trip_segs s,
-    connections c,
-    trips t
+    route_segment_hours h
+    JOIN overlap_segments seg USING (segment_id)
 WHERE
-    t.trip_id = s.trip_id
-    AND s.route_id = c.route_id
-    AND t.direction_id = c.direction_id
-    AND s.stop1_sequence = c.from_stop_sequence
-    AND s.stop2_sequence = c.to_stop_sequence
-    AND date = '2025-07-08'
-    AND route_type = '3'
-    AND stop1_arrival_time BETWEEN '15:00:00' AND '17:00:00'
+    h.date = '2025-07-08'
+    AND h.route_type = '3'
+    AND h.hour >= 15 AND h.hour < 17
 GROUP BY
-    c.from_stop_id,
-    c.from_stop_name,
-    c.to_stop_id,
-    c.to_stop_name,
-    s.seg_geom;
+    seg.segment_id;
 
  -- Clippear raster
 CREATE TABLE prague_pop AS (
@@ -135,6 +127,8 @@ FROM shopping_malls s
 ORDER BY distance_km;
 
 -- Identificar los trips cercanos a los shoppings
+-- Se arma a partir del indice de poi_proximity.sql (radio de 200 m, intervalos de 2 horas) en vez de
+-- expandir los instantes de cada trip. Para otros POIs, radios o intervalos usar trips_near_shopping.py
 DROP TABLE IF EXISTS shopping_trip_intervals;
 CREATE TABLE shopping_trip_intervals (
     shopping_name TEXT,
@@ -143,28 +137,26 @@ CREATE TABLE shopping_trip_intervals (
 );
 
 INSERT INTO shopping_trip_intervals (shopping_name, interv, trips_nearby)
-WITH instants AS (
-  SELECT 
-    s.name AS shopping_name,
-    t.trip_id,
-    getTimestamp(unnest(instants(t.trip))) AS instant_time
-  FROM shopping_malls s
-  JOIN trips_mdb t ON ST_DWithin(s.geom, t.traj, 200)
-), ranges AS (
-  SELECT 
-    shopping_name,
-    trip_id,
-    instant_time,
-    (EXTRACT(HOUR FROM instant_time)::int / 2) * 2 AS range_start
-  FROM instants
+WITH days AS (
+  -- Un dia extra para los trips que terminan despues de medianoche
+  SELECT generate_series(MIN(date), MAX(date) + 1, interval '1 day')::date AS date FROM trips_mdb
+), buckets AS (
+  SELECT
+    range_start,
+    tstzrange(d.date + make_interval(hours => range_start), d.date + make_interval(hours => range_start + 2)) AS bucket
+  FROM days d
+  CROSS JOIN generate_series(0, 22, 2) AS range_start
 )
 SELECT
-  shopping_name,
-  lpad(range_start::text, 2, '0') || ':00–' || lpad((range_start+1)::text, 2, '0') || ':59' AS interv,
-  COUNT(DISTINCT trip_id) AS trips_nearby
-FROM ranges
-GROUP BY shopping_name, range_start
-ORDER BY shopping_name, range_start;
+  p.name AS shopping_name,
+  lpad(b.range_start::text, 2, '0') || ':00–' || lpad((b.range_start+1)::text, 2, '0') || ':59' AS interv,
+  COUNT(DISTINCT x.trip_id) AS trips_nearby
+FROM poi_proximity x
+JOIN pois p ON p.poi_id = x.poi_id
+JOIN buckets b ON x.during && b.bucket
+WHERE p.category = 'shopping' AND x.radius = 200
+GROUP BY p.name, b.range_start
+ORDER BY p.name, b.range_start;
 
 
 -- Calcular velocidades promedio de los segmentos
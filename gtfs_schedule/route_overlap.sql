@@ -0,0 +1,55 @@
+-- Cubo de superposicion de rutas por segmento fisico (par de paradas).
+-- En una sola pasada sobre trip_segs se guarda, para cada fecha de servicio, tipo de ruta y hora
+-- (hora de servicio GTFS, puede ser >= 24), que rutas recorren cada segmento. La cantidad de rutas
+-- distintas de cualquier ventana horaria se obtiene despues uniendo las horas que la componen,
+-- sin volver a recorrer trip_segs (ver agg_routes_per_segment.py y SegmentsDisplay en queries.sql).
+-- Requiere trip_segs (mdb_importer_scheduled.sql) y service_days (gtfs-via-postgres).
+
+-- stage: overlap_segments
+-- Un id entero por segmento, en lugar de agrupar por geometria
+DROP TABLE IF EXISTS overlap_segments CASCADE;
+CREATE TABLE overlap_segments AS
+SELECT
+    (ROW_NUMBER() OVER (ORDER BY stop1_id, stop2_id))::integer AS segment_id,
+    stop1_id,
+    stop2_id,
+    seg_geom
+FROM (
+    SELECT DISTINCT ON (stop1_id, stop2_id) stop1_id, stop2_id, seg_geom
+    FROM trip_segs
+    WHERE seg_geom IS NOT NULL
+    ORDER BY stop1_id, stop2_id, trip_id
+) s;
+
+ALTER TABLE overlap_segments ADD PRIMARY KEY (segment_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_overlap_segments_stops ON overlap_segments (stop1_id, stop2_id);
+CREATE INDEX IF NOT EXISTS idx_overlap_segments_geom ON overlap_segments USING GIST (seg_geom);
+
+-- stage: overlap_routes
+DROP TABLE IF EXISTS overlap_routes CASCADE;
+CREATE TABLE overlap_routes AS
+SELECT
+    (ROW_NUMBER() OVER (ORDER BY route_id))::smallint AS route_code,
+    route_id,
+    route_type
+FROM routes;
+
+ALTER TABLE overlap_routes ADD PRIMARY KEY (route_code);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_overlap_routes_route_id ON overlap_routes (route_id);
+
+-- stage: route_segment_hours
+DROP TABLE IF EXISTS route_segment_hours CASCADE;
+CREATE TABLE route_segment_hours AS
+SELECT DISTINCT
+    sd.date,
+    r.route_type,
+    (EXTRACT(EPOCH FROM s.stop1_arrival_time)::integer / 3600)::smallint AS hour,
+    seg.segment_id,
+    r.route_code
+FROM trip_segs s
+JOIN service_days sd ON sd.service_id = s.service_id
+JOIN overlap_routes r ON r.route_id = s.route_id
+JOIN overlap_segments seg ON seg.stop1_id = s.stop1_id AND seg.stop2_id = s.stop2_id;
+
+CREATE INDEX IF NOT EXISTS idx_route_segment_hours_window ON route_segment_hours (date, route_type, hour);
+ANALYZE route_segment_hours;
@@ -1,3 +1,4 @@
+import argparse
 import psycopg2
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -8,22 +9,82 @@ DB_NAME = "prague"
 DB_USER = "postgres"
 DB_PASS = ""
 
-# 1. Query que une trips y distancia de cada shopping
+# Centro de Praga, para ordenar los POIs por distancia
+CENTER_LON = 14.420917
+CENTER_LAT = 50.087008
+
+# 1. Query sobre el indice de poi_proximity.sql: trips dentro del radio de cada POI
+# por intervalo horario, junto con la distancia del POI al centro
 query = """
-SELECT sti.shopping_name, sti.interv, sti.trips_nearby, tcs.distance_km
-FROM shopping_trip_intervals sti
-JOIN trajectories_center_shopping tcs
-  ON sti.shopping_name = tcs.name
-ORDER BY sti.interv, sti.shopping_name;
+WITH service_range AS (
+  SELECT
+    COALESCE(%(start)s::date, MIN(date)) AS first_date,
+    COALESCE(%(end)s::date, MAX(date)) AS last_date
+  FROM poi_proximity
+), days AS (
+  -- Un dia mas que el ultimo de servicio: los viajes que siguen despues de medianoche
+  SELECT generate_series(first_date, last_date + 1, interval '1 day')::date AS date
+  FROM service_range
+), buckets AS (
+  SELECT
+    range_start,
+    -- El ultimo intervalo termina a medianoche aunque bucket_hours no divida a 24
+    tstzrange(
+      d.date + make_interval(hours => range_start),
+      d.date + make_interval(hours => LEAST(range_start + %(bucket_hours)s, 24))
+    ) AS bucket
+  FROM days d
+  CROSS JOIN generate_series(0, 23, %(bucket_hours)s) AS range_start
+)
+SELECT
+  p.name,
+  lpad(b.range_start::text, 2, '0') || ':00–'
+    || lpad(LEAST(b.range_start + %(bucket_hours)s - 1, 23)::text, 2, '0') || ':59' AS interv,
+  COUNT(DISTINCT x.trip_id) AS trips_nearby,
+  ST_DistanceSphere(
+    ST_SetSRID(ST_MakePoint(%(center_lon)s, %(center_lat)s), 4326),
+    ST_Transform(p.geom, 4326)
+  ) / 1000.0 AS distance_km
+FROM poi_proximity x
+JOIN pois p ON p.poi_id = x.poi_id
+JOIN buckets b ON x.during && b.bucket
+CROSS JOIN service_range r
+WHERE x.radius = %(radius)s
+  AND x.date BETWEEN r.first_date AND r.last_date
+  AND p.category = %(category)s
+  AND (%(names)s::text[] IS NULL OR p.name = ANY(%(names)s::text[]))
+GROUP BY p.poi_id, p.name, p.geom, b.range_start
+ORDER BY interv, p.name;
 """
 
 
-def fetch_shopping_trips():
+def fetch_shopping_trips(category="shopping", radius=200, bucket_hours=2, names=None, start=None, end=None):
+    if not 1 <= bucket_hours <= 24:
+        raise ValueError(f"bucket_hours must be between 1 and 24, got {bucket_hours}")
     conn = psycopg2.connect(
         host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS
     )
     cur = conn.cursor()
-    cur.execute(query)
+    cur.execute("SELECT 1 FROM poi_radii WHERE radius = %s;", (radius,))
+    if cur.fetchone() is None:
+        cur.close()
+        conn.close()
+        raise ValueError(
+            f"Radius {radius} is not indexed: add it to poi_radii and rerun poi_proximity.sql"
+        )
+    cur.execute(
+        query,
+        {
+            "category": category,
+            "radius": radius,
+            "bucket_hours": bucket_hours,
+            "names": names,
+            "start": start,
+            "end": end,
+            "center_lon": CENTER_LON,
+            "center_lat": CENTER_LAT,
+        },
+    )
     data = cur.fetchall()
     cur.close()
     conn.close()
@@ -45,7 +106,7 @@ def plot_shopping_trips(df):
     n = len(avg_distance)
     cmap = plt.cm.magma
     # Para que el MÁS LEJANO sea el más claro: el primero de la lista es el más cercano (más oscuro)
-    colors = [cmap(i / (n - 1)) for i in range(n)]
+    colors = [cmap(i / max(n - 1, 1)) for i in range(n)]
     color_dict = dict(zip(avg_distance["shopping_name"], colors))
 
     pivot = df.pivot(
@@ -80,5 +141,18 @@ def plot_shopping_trips(df):
 
 
 if __name__ == "__main__":
-    df = fetch_shopping_trips()
+    parser = argparse.ArgumentParser(
+        description="Plot the number of trips near each POI per time interval."
+    )
+    parser.add_argument("--category", default="shopping", help="POI category in the pois table")
+    parser.add_argument("--names", nargs="+", help="Only these POIs of the category")
+    parser.add_argument("--radius", type=int, default=200, help="Radius in meters (must be in poi_radii)")
+    parser.add_argument("--bucket-hours", type=int, default=2, help="Interval length in hours (1-24); the last interval of the day ends at midnight")
+    parser.add_argument("--start", help="First service date, e.g. 2025-07-11")
+    parser.add_argument("--end", help="Last service date (inclusive, with its trips after midnight)")
+    args = parser.parse_args()
+
+    df = fetch_shopping_trips(
+        args.category, args.radius, args.bucket_hours, args.names, args.start, args.end
+    )
     plot_shopping_trips(df)
@@ -0,0 +1,629 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from shapely.ops import substring
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "gtfs_realtime"))
+
+from live_delays import LiveDelayEngine, PASSAGE_RADIUS, Schedule
+from speed_profiles import BIN_WIDTH, NUM_BINS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Igual que en PostGIS: largos y distancias en S-JTSK, geometrias de salida en WGS84 (GeoParquet)
+METRIC_CRS = "EPSG:5514"
+TIMEZONE = "Europe/Prague"
+GRID_SIZE = 1000
+
+to_metric = Transformer.from_crs("EPSG:4326", METRIC_CRS, always_xy=True)
+to_wgs84 = Transformer.from_crs(METRIC_CRS, "EPSG:4326", always_xy=True)
+
+GTFS_TABLES = ("routes", "trips", "stops", "stop_times", "shapes", "calendar", "calendar_dates")
+
+
+def sql_path(path):
+    return "'" + os.path.abspath(path).replace("'", "''") + "'"
+
+
+def connect(threads=None):
+    con = duckdb.connect()
+    con.execute("INSTALL spatial; LOAD spatial;")
+    # Los extractores escriben fetch_time / timestamp en UTC sin zona: no depender de la zona local
+    con.execute("SET TimeZone = 'UTC'")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    # Horarios GTFS (pueden pasar de 24:00:00) a segundos del dia de servicio
+    con.execute(
+        """
+        CREATE MACRO gtfs_seconds(t) AS
+            TRY_CAST(split_part(t, ':', 1) AS INTEGER) * 3600
+            + TRY_CAST(split_part(t, ':', 2) AS INTEGER) * 60
+            + TRY_CAST(split_part(t, ':', 3) AS INTEGER)
+        """
+    )
+    return con
+
+
+def run_stage(name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    logging.info(f"{name}: {time.perf_counter() - start:.2f} s")
+    return result
+
+
+def load_gtfs(con, gtfs_dir):
+    """Loads the GTFS text files as all-varchar tables, like gtfs-to-sql does with the schema."""
+    for table in GTFS_TABLES:
+        path = os.path.join(gtfs_dir, f"{table}.txt")
+        if os.path.exists(path):
+            con.execute(
+                f"CREATE TABLE {table} AS SELECT * FROM read_csv({sql_path(path)}, header = true, all_varchar = true)"
+            )
+        elif table == "calendar":
+            con.execute("CREATE TABLE calendar (service_id VARCHAR, monday VARCHAR, tuesday VARCHAR, wednesday VARCHAR, thursday VARCHAR, friday VARCHAR, saturday VARCHAR, sunday VARCHAR, start_date VARCHAR, end_date VARCHAR)")
+        elif table == "calendar_dates":
+            con.execute("CREATE TABLE calendar_dates (service_id VARCHAR, date VARCHAR, exception_type VARCHAR)")
+        else:
+            raise FileNotFoundError(path)
+
+    # Equivalente a service_days de gtfs-via-postgres
+    con.execute(
+        """
+        CREATE TABLE service_days AS
+        WITH regular AS (
+            SELECT c.service_id, CAST(d AS DATE) AS date
+            FROM calendar c,
+                 generate_series(
+                     CAST(strptime(c.start_date, '%Y%m%d') AS DATE),
+                     CAST(strptime(c.end_date, '%Y%m%d') AS DATE),
+                     INTERVAL 1 DAY
+                 ) AS g(d)
+            WHERE CASE isodow(d)
+                WHEN 1 THEN c.monday WHEN 2 THEN c.tuesday WHEN 3 THEN c.wednesday
+                WHEN 4 THEN c.thursday WHEN 5 THEN c.friday WHEN 6 THEN c.saturday
+                ELSE c.sunday
+            END = '1'
+        ), exceptions AS (
+            SELECT service_id, CAST(strptime(date, '%Y%m%d') AS DATE) AS date, exception_type
+            FROM calendar_dates
+        )
+        SELECT r.service_id, r.date FROM regular r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM exceptions e
+            WHERE e.service_id = r.service_id AND e.date = r.date AND e.exception_type = '2'
+        )
+        UNION
+        SELECT service_id, date FROM exceptions WHERE exception_type = '1'
+        """
+    )
+
+
+def build_shape_lines(con):
+    """Shape LineStrings in METRIC_CRS and a shape_id -> position map."""
+    shapes = con.execute(
+        """
+        SELECT shape_id, CAST(shape_pt_lon AS DOUBLE) AS lon, CAST(shape_pt_lat AS DOUBLE) AS lat
+        FROM shapes
+        ORDER BY shape_id, CAST(shape_pt_sequence AS INTEGER)
+        """
+    ).fetchnumpy()
+    shape_ids, codes, counts = np.unique(shapes["shape_id"], return_inverse=True, return_counts=True)
+    # Shapes de un solo punto no forman una linea
+    valid = counts[codes] >= 2
+    shape_ids, codes = np.unique(shapes["shape_id"][valid], return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    x, y = to_metric.transform(shapes["lon"][valid][order], shapes["lat"][valid][order])
+    lines = shapely.linestrings(x, y, indices=codes[order])
+    return lines, {shape_id: i for i, shape_id in enumerate(shape_ids)}
+
+
+def build_trip_stops(con, lines, shape_index):
+    """trip_stops with the stop position along the shape (perc), as in mdb_importer_scheduled.sql."""
+    con.execute(
+        """
+        CREATE TABLE trip_stops_base AS
+        SELECT t.trip_id,
+               CAST(st.stop_sequence AS INTEGER) AS stop_sequence,
+               t.route_id, t.service_id, t.shape_id, st.stop_id,
+               gtfs_seconds(st.arrival_time) AS arrival_time
+        FROM trips t JOIN stop_times st USING (trip_id)
+        """
+    )
+    pairs = con.execute(
+        """
+        SELECT DISTINCT ts.shape_id, ts.stop_id,
+               CAST(s.stop_lon AS DOUBLE) AS lon, CAST(s.stop_lat AS DOUBLE) AS lat
+        FROM trip_stops_base ts JOIN stops s USING (stop_id)
+        WHERE ts.shape_id IS NOT NULL
+        """
+    ).fetchdf()
+    line_pos = pairs["shape_id"].map(shape_index)
+    pairs = pairs[line_pos.notna()]
+    line_pos = line_pos[line_pos.notna()].astype(int).to_numpy()
+    x, y = to_metric.transform(pairs["lon"].to_numpy(), pairs["lat"].to_numpy())
+    stop_percs = pd.DataFrame(
+        {
+            "shape_id": pairs["shape_id"].to_numpy(),
+            "stop_id": pairs["stop_id"].to_numpy(),
+            "perc": shapely.line_locate_point(lines[line_pos], shapely.points(x, y), normalized=True),
+        }
+    )
+    con.register("stop_percs", stop_percs)
+    con.execute(
+        """
+        CREATE TABLE trip_stops AS
+        SELECT ts.*,
+               MAX(ts.stop_sequence) OVER (PARTITION BY ts.trip_id) AS num_stops,
+               CASE
+                 WHEN ts.stop_sequence = MIN(ts.stop_sequence) OVER (PARTITION BY ts.trip_id) THEN 0.0
+                 WHEN ts.stop_sequence = MAX(ts.stop_sequence) OVER (PARTITION BY ts.trip_id) THEN 1.0
+                 ELSE p.perc
+               END AS perc
+        FROM trip_stops_base ts
+        LEFT JOIN stop_percs p USING (shape_id, stop_id)
+        """
+    )
+    con.unregister("stop_percs")
+    con.execute("DROP TABLE trip_stops_base")
+
+
+def build_trip_segs(con, lines, shape_index):
+    """
+    trip_segs between consecutive stops. Segment geometries are cut once per
+    distinct (shape, perc1, perc2) piece and shared by every trip using it;
+    trips with any uncut segment are dropped, as in the PostGIS importer.
+    """
+    con.execute(
+        """
+        CREATE TABLE trip_segs_raw AS
+        SELECT * FROM (
+            SELECT trip_id, route_id, service_id,
+                   stop_sequence AS stop1_sequence,
+                   LEAD(stop_sequence) OVER w AS stop2_sequence,
+                   num_stops,
+                   stop_id AS stop1_id,
+                   LEAD(stop_id) OVER w AS stop2_id,
+                   shape_id,
+                   arrival_time AS stop1_arrival_time,
+                   LEAD(arrival_time) OVER w AS stop2_arrival_time,
+                   perc AS perc1,
+                   LEAD(perc) OVER w AS perc2
+            FROM trip_stops
+            WINDOW w AS (PARTITION BY trip_id ORDER BY stop_sequence)
+        )
+        WHERE stop2_sequence IS NOT NULL
+        """
+    )
+    pieces = con.execute(
+        """
+        SELECT DISTINCT shape_id, perc1, perc2
+        FROM trip_segs_raw
+        WHERE perc1 IS NOT NULL AND perc2 IS NOT NULL AND perc1 <= perc2
+        """
+    ).fetchdf()
+    pieces = pieces[pieces["shape_id"].isin(shape_index)].reset_index(drop=True)
+
+    geoms = np.array(
+        [
+            substring(lines[shape_index[shape_id]], perc1, perc2, normalized=True)
+            for shape_id, perc1, perc2 in pieces.itertuples(index=False)
+        ],
+        dtype=object,
+    )
+    pieces["piece_id"] = np.arange(len(pieces), dtype=np.int64)
+    pieces["seg_length"] = shapely.length(geoms)
+    pieces["no_points"] = shapely.get_num_coordinates(geoms)
+    pieces["wkb"] = shapely.to_wkb(shapely.transform(geoms, wgs84_coords))
+
+    # Puntos de cada pieza con la fraccion del largo recorrida hasta cada uno
+    coords, piece = shapely.get_coordinates(geoms, return_index=True)
+    step = np.hypot(*np.diff(coords, axis=0, prepend=coords[:1]).T)
+    first = np.r_[True, piece[1:] != piece[:-1]]
+    step[first] = 0
+    cumulative = np.cumsum(step)
+    cumulative -= np.maximum.accumulate(np.where(first, cumulative, 0))
+    starts = np.flatnonzero(first)
+    point_sequence = np.arange(len(piece)) - np.repeat(starts, np.diff(np.r_[starts, len(piece)])) + 1
+    lengths = pieces["seg_length"].to_numpy()[piece]
+    lon, lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+    piece_points = pd.DataFrame(
+        {
+            "piece_id": piece.astype(np.int64),
+            "point_sequence": point_sequence,
+            "lon": lon,
+            "lat": lat,
+            "perc": np.divide(cumulative, lengths, out=np.zeros_like(cumulative), where=lengths > 0),
+        }
+    )
+
+    con.register("pieces_df", pieces)
+    con.register("piece_points_df", piece_points)
+    con.execute("CREATE TABLE pieces AS SELECT * FROM pieces_df")
+    con.execute("CREATE TABLE piece_points AS SELECT * FROM piece_points_df")
+    con.unregister("pieces_df")
+    con.unregister("piece_points_df")
+    con.execute(
+        """
+        CREATE TABLE trip_segs AS
+        WITH joined AS (
+            SELECT s.*, p.piece_id, p.seg_length, p.no_points
+            FROM trip_segs_raw s
+            LEFT JOIN pieces p USING (shape_id, perc1, perc2)
+        )
+        SELECT * FROM joined
+        WHERE trip_id NOT IN (SELECT trip_id FROM joined WHERE piece_id IS NULL)
+        """
+    )
+    con.execute("DROP TABLE trip_segs_raw")
+
+
+def wgs84_coords(coords):
+    lon, lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([lon, lat])
+
+
+def metric_coords(coords):
+    x, y = to_metric.transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
+
+def load_area(path):
+    """Union of the polygons of a GeoJSON file, in METRIC_CRS."""
+    with open(path) as f:
+        geom = shapely.from_geojson(f.read())
+    return shapely.transform(shapely.union_all(shapely.get_parts(geom)), metric_coords)
+
+
+def write_trip_segs(con, output_dir):
+    con.execute(
+        f"""
+        COPY (
+            SELECT s.* EXCLUDE (piece_id), ST_GeomFromWKB(p.wkb) AS seg_geom
+            FROM trip_segs s JOIN pieces p USING (piece_id)
+        ) TO {sql_path(os.path.join(output_dir, 'trip_segs.parquet'))} (FORMAT PARQUET)
+        """
+    )
+
+
+def write_trip_points(con, output_dir):
+    """trip_points, with point_arrival_time in seconds of the service day."""
+    con.execute(
+        f"""
+        COPY (
+            SELECT s.trip_id, s.route_id, s.service_id, s.stop1_sequence, pp.point_sequence,
+                   CASE
+                     WHEN pp.point_sequence = 1 THEN s.stop1_arrival_time
+                     WHEN pp.point_sequence = s.no_points THEN s.stop2_arrival_time
+                     ELSE s.stop1_arrival_time + (s.stop2_arrival_time - s.stop1_arrival_time) * pp.perc
+                   END AS point_arrival_time,
+                   ST_Point(pp.lon, pp.lat) AS point_geom
+            FROM trip_segs s
+            JOIN piece_points pp USING (piece_id)
+            WHERE pp.point_sequence <> s.no_points OR s.stop2_sequence = s.num_stops
+        ) TO {sql_path(os.path.join(output_dir, 'trip_points.parquet'))} (FORMAT PARQUET)
+        """
+    )
+
+
+def build_observed_segments(con, positions_path, service_date, radius=PASSAGE_RADIUS):
+    """
+    Observed stop passages from matched (or raw) positions, detected with the
+    same engine as live_delays.py, and trip_segments_rt between consecutive
+    passages of each trip.
+    """
+    stops = con.execute(
+        """
+        SELECT ts.trip_id, ts.stop_sequence, ts.stop_id, ts.arrival_time,
+               CAST(s.stop_lon AS DOUBLE) AS lon, CAST(s.stop_lat AS DOUBLE) AS lat
+        FROM trip_stops ts
+        JOIN service_days sd ON sd.service_id = ts.service_id AND sd.date = CAST(? AS DATE)
+        JOIN stops s USING (stop_id)
+        WHERE ts.arrival_time IS NOT NULL
+        """,
+        [service_date],
+    ).fetchdf()
+    midnight = pd.Timestamp(service_date, tz=TIMEZONE).timestamp()
+    stops["scheduled"] = midnight + stops["arrival_time"]
+    stops["x"], stops["y"] = to_metric.transform(stops["lon"].to_numpy(), stops["lat"].to_numpy())
+    schedule = Schedule(stops)
+
+    positions = con.execute(
+        f"""
+        SELECT trip_id,
+               CAST(latitude AS DOUBLE) AS latitude,
+               CAST(longitude AS DOUBLE) AS longitude,
+               COALESCE(
+                   TRY_CAST(CAST(timestamp AS VARCHAR) AS DOUBLE),
+                   epoch(TRY_CAST(CAST(timestamp AS VARCHAR) AS TIMESTAMPTZ))
+               ) AS t
+        FROM {'read_csv' if positions_path.endswith('.csv') else 'read_parquet'}({sql_path(positions_path)})
+        WHERE trip_id IS NOT NULL
+        ORDER BY trip_id, t
+        """
+    ).fetchdf()
+    positions["trip"] = positions["trip_id"].map(schedule.trip_index)
+    positions = positions[positions["trip"].notna() & positions["t"].notna()]
+    positions["rank"] = positions.groupby("trip").cumcount()
+    x, y = to_metric.transform(positions["longitude"].to_numpy(), positions["latitude"].to_numpy())
+    positions["x"], positions["y"] = x, y
+
+    # Una llamada por posicion k de cada trip: cada llamada avanza todos los trips a la vez
+    engine = LiveDelayEngine(schedule, radius=radius)
+    passages = []
+    for _, group in positions.groupby("rank", sort=True):
+        passages.extend(
+            engine.process(
+                group["trip"].to_numpy(dtype=np.int64),
+                group["x"].to_numpy(),
+                group["y"].to_numpy(),
+                group["t"].to_numpy(dtype=np.float64),
+            )
+        )
+    passages = pd.DataFrame(
+        passages,
+        columns=["trip_id", "stop_id", "stop_sequence", "scheduled_time", "actual_time", "delay_seconds"],
+    )
+    con.register("passages_df", passages)
+    con.execute("CREATE TABLE stop_passages AS SELECT * FROM passages_df")
+    con.unregister("passages_df")
+    con.execute(
+        """
+        CREATE TABLE trip_segments_rt AS
+        SELECT p.trip_id AS actual_trip_id,
+               p.trip_id AS schedule_trip_id,
+               t.shape_id,
+               p.stop_id AS end_stop_id,
+               p.scheduled_time AS end_time_schedule,
+               p.actual_time AS end_time_actual,
+               LAG(p.stop_id) OVER w AS start_stop_id,
+               LAG(p.scheduled_time) OVER w AS start_time_schedule,
+               LAG(p.actual_time) OVER w AS start_time_actual
+        FROM stop_passages p
+        JOIN trips t USING (trip_id)
+        WINDOW w AS (PARTITION BY p.trip_id ORDER BY p.stop_sequence)
+        """
+    )
+    return len(passages)
+
+
+def write_speed_aggregates(con, output_dir, observed):
+    """schedule_speeds (queries.sql) and segment_speed_profiles (speed_profiles.sql)."""
+    con.execute(
+        f"""
+        COPY (
+            SELECT a.id, a.speed_kmh, ST_GeomFromWKB(p.wkb) AS seg_geom
+            FROM (
+                SELECT route_id || stop1_sequence || stop2_sequence AS id,
+                       piece_id,
+                       AVG(seg_length / (stop2_arrival_time - stop1_arrival_time) * 3.6) AS speed_kmh
+                FROM trip_segs
+                WHERE stop2_arrival_time <> stop1_arrival_time
+                GROUP BY route_id, stop1_sequence, stop2_sequence, piece_id
+            ) a
+            JOIN pieces p USING (piece_id)
+        ) TO {sql_path(os.path.join(output_dir, 'schedule_speeds.parquet'))} (FORMAT PARQUET)
+        """
+    )
+
+    observed_samples = (
+        """
+        UNION ALL
+        SELECT t.start_stop_id, t.end_stop_id,
+               CAST(hour(timezone(?, to_timestamp(t.start_time_actual))) AS INTEGER),
+               r.route_type, 'observed',
+               l.seg_length / (t.end_time_actual - t.start_time_actual) * 3.6
+        FROM trip_segments_rt t
+        JOIN seg_lengths l
+          ON l.shape_id = t.shape_id AND l.stop1_id = t.start_stop_id AND l.stop2_id = t.end_stop_id
+        JOIN routes r ON r.route_id = l.route_id
+        WHERE t.start_time_actual IS NOT NULL
+          AND t.end_time_actual > t.start_time_actual
+        UNION ALL
+        SELECT s.stop1_id, s.stop2_id,
+               CAST((s.stop1_arrival_time // 3600) % 24 AS INTEGER),
+               r.route_type, 'scheduled_observed',
+               s.seg_length / (s.stop2_arrival_time - s.stop1_arrival_time) * 3.6
+        FROM trip_segs s
+        JOIN routes r USING (route_id)
+        WHERE s.stop2_arrival_time > s.stop1_arrival_time
+          AND EXISTS (
+              SELECT 1 FROM trip_segments_rt t
+              WHERE t.shape_id = s.shape_id AND t.start_stop_id = s.stop1_id AND t.end_stop_id = s.stop2_id
+                AND t.start_time_actual IS NOT NULL AND t.end_time_actual > t.start_time_actual
+          )
+        """
+        if observed
+        else ""
+    )
+    con.execute(
+        f"""
+        CREATE TABLE segment_speed_samples AS
+        WITH seg_lengths AS (
+            SELECT DISTINCT ON (shape_id, stop1_id, stop2_id)
+                shape_id, stop1_id, stop2_id, route_id, seg_length
+            FROM trip_segs
+        )
+        SELECT s.stop1_id, s.stop2_id,
+               CAST((s.stop1_arrival_time // 3600) % 24 AS INTEGER) AS hour_bucket,
+               r.route_type,
+               'scheduled' AS kind,
+               s.seg_length / (s.stop2_arrival_time - s.stop1_arrival_time) * 3.6 AS speed_kmh
+        FROM trip_segs s
+        JOIN routes r USING (route_id)
+        WHERE s.stop2_arrival_time > s.stop1_arrival_time
+        {observed_samples}
+        """,
+        [TIMEZONE] if observed else [],
+    )
+    con.execute(
+        f"""
+        COPY (
+            WITH binned AS (
+                SELECT stop1_id, stop2_id, hour_bucket, route_type, kind,
+                       LEAST(CAST(FLOOR(speed_kmh / {BIN_WIDTH}) AS INTEGER), {NUM_BINS - 1}) AS bin,
+                       COUNT(*) AS c,
+                       SUM(speed_kmh) AS s,
+                       MIN(speed_kmh) AS mn,
+                       MAX(speed_kmh) AS mx
+                FROM segment_speed_samples
+                GROUP BY ALL
+            )
+            SELECT stop1_id, stop2_id, hour_bucket, route_type, kind,
+                   CAST(SUM(c) AS INTEGER) AS n,
+                   SUM(s) AS speed_sum,
+                   MIN(mn) AS speed_min,
+                   MAX(mx) AS speed_max,
+                   list(CAST(bin AS SMALLINT) ORDER BY bin) AS bins,
+                   list(CAST(c AS INTEGER) ORDER BY bin) AS counts
+            FROM binned
+            GROUP BY stop1_id, stop2_id, hour_bucket, route_type, kind
+        ) TO {sql_path(os.path.join(output_dir, 'segment_speed_profiles.parquet'))} (FORMAT PARQUET)
+        """
+    )
+
+
+def write_route_overlap(con, output_dir):
+    """overlap_segments and route_segment_hours, as in route_overlap.sql."""
+    con.execute(
+        """
+        CREATE TABLE overlap_segments AS
+        SELECT CAST(ROW_NUMBER() OVER (ORDER BY stop1_id, stop2_id) AS INTEGER) AS segment_id,
+               stop1_id, stop2_id, piece_id
+        FROM (
+            SELECT DISTINCT ON (stop1_id, stop2_id) stop1_id, stop2_id, piece_id
+            FROM trip_segs
+            ORDER BY stop1_id, stop2_id, trip_id
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE overlap_routes AS
+        SELECT CAST(ROW_NUMBER() OVER (ORDER BY route_id) AS SMALLINT) AS route_code, route_id, route_type
+        FROM routes
+        """
+    )
+    con.execute(
+        f"""
+        COPY (
+            SELECT seg.segment_id, seg.stop1_id, seg.stop2_id, ST_GeomFromWKB(p.wkb) AS seg_geom
+            FROM overlap_segments seg JOIN pieces p USING (piece_id)
+        ) TO {sql_path(os.path.join(output_dir, 'overlap_segments.parquet'))} (FORMAT PARQUET)
+        """
+    )
+    con.execute(
+        f"""
+        COPY (
+            SELECT DISTINCT sd.date, r.route_type,
+                   CAST(s.stop1_arrival_time // 3600 AS SMALLINT) AS hour,
+                   seg.segment_id, r.route_code
+            FROM trip_segs s
+            JOIN service_days sd ON sd.service_id = s.service_id
+            JOIN overlap_routes r ON r.route_id = s.route_id
+            JOIN overlap_segments seg ON seg.stop1_id = s.stop1_id AND seg.stop2_id = s.stop2_id
+        ) TO {sql_path(os.path.join(output_dir, 'route_segment_hours.parquet'))} (FORMAT PARQUET)
+        """
+    )
+
+
+def write_grid_counts(con, output_dir, lines, shape_index, service_date, area_path=None, grid_size=GRID_SIZE):
+    """
+    grid_trip_counts: distinct trips of the service date crossing each 1 km
+    cell of the area (province polygon, or the stops' bounding box).
+    Shapes are intersected with the cells once and weighted by their trips.
+    """
+    if area_path:
+        area = load_area(area_path)
+    else:
+        area = shapely.envelope(shapely.multilinestrings(lines))
+
+    xmin, ymin, xmax, ymax = shapely.bounds(area)
+    xs = np.arange(np.floor(xmin / grid_size) * grid_size, xmax, grid_size)
+    ys = np.arange(np.floor(ymin / grid_size) * grid_size, ymax, grid_size)
+    gx, gy = np.meshgrid(xs, ys)
+    cells = shapely.box(gx.ravel(), gy.ravel(), gx.ravel() + grid_size, gy.ravel() + grid_size)
+    clipped = shapely.intersection(cells, area)
+    keep = ~shapely.is_empty(clipped)
+    cells = clipped[keep]
+
+    cell_idx, line_idx = shapely.STRtree(lines).query(cells, predicate="intersects")
+    shape_ids = np.empty(len(shape_index), dtype=object)
+    for shape_id, i in shape_index.items():
+        shape_ids[i] = shape_id
+    hits = pd.DataFrame({"grid_id": cell_idx + 1, "shape_id": shape_ids[line_idx]})
+    grid = pd.DataFrame(
+        {
+            "grid_id": np.arange(1, len(cells) + 1),
+            "wkb": shapely.to_wkb(shapely.transform(cells, wgs84_coords)),
+        }
+    )
+    con.register("grid_hits", hits)
+    con.register("grid_cells", grid)
+    con.execute(
+        f"""
+        COPY (
+            SELECT g.grid_id,
+                   COUNT(DISTINCT t.trip_id) AS trips_count,
+                   ST_GeomFromWKB(ANY_VALUE(g.wkb)) AS geom
+            FROM grid_cells g
+            LEFT JOIN grid_hits h USING (grid_id)
+            LEFT JOIN (
+                SELECT t.trip_id, t.shape_id
+                FROM trips t
+                JOIN service_days sd ON sd.service_id = t.service_id AND sd.date = CAST(? AS DATE)
+            ) t USING (shape_id)
+            GROUP BY g.grid_id
+            ORDER BY g.grid_id
+        ) TO {sql_path(os.path.join(output_dir, 'grid_trip_counts.parquet'))} (FORMAT PARQUET)
+        """,
+        [service_date],
+    )
+    con.unregister("grid_hits")
+    con.unregister("grid_cells")
+
+
+def run_pipeline(gtfs_dir, output_dir, service_date, positions=None, area=None, threads=None):
+    os.makedirs(output_dir, exist_ok=True)
+    con = connect(threads)
+    run_stage("load_gtfs", load_gtfs, con, gtfs_dir)
+    lines, shape_index = run_stage("shape_lines", build_shape_lines, con)
+    run_stage("trip_stops", build_trip_stops, con, lines, shape_index)
+    run_stage("trip_segs", build_trip_segs, con, lines, shape_index)
+    run_stage("write_trip_segs", write_trip_segs, con, output_dir)
+    run_stage("write_trip_points", write_trip_points, con, output_dir)
+    if positions:
+        passages = run_stage("observed_segments", build_observed_segments, con, positions, service_date)
+        logging.info(f"{passages} observed stop passages")
+    run_stage("speed_aggregates", write_speed_aggregates, con, output_dir, bool(positions))
+    run_stage("route_overlap", write_route_overlap, con, output_dir)
+    run_stage("grid_counts", write_grid_counts, con, output_dir, lines, shape_index, service_date, area)
+    con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build trip_segs/trip_points and the speed and grid aggregates with DuckDB, without PostgreSQL."
+    )
+    parser.add_argument("gtfs_dir", help="Directory with the GTFS .txt files")
+    parser.add_argument("output_dir", help="Directory for the GeoParquet outputs")
+    parser.add_argument("--date", required=True, help="Service date, e.g. 2025-07-08")
+    parser.add_argument(
+        "--positions",
+        help="Matched positions (map_matched_positions.csv) or a captured positions Parquet, for observed speeds",
+    )
+    parser.add_argument("--area", help="GeoJSON polygon for the grid (e.g. the exported province boundary)")
+    parser.add_argument("--threads", type=int, help="DuckDB threads (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    run_pipeline(args.gtfs_dir, args.output_dir, args.date, args.positions, args.area, args.threads)
+    logging.info(f"Outputs written to {args.output_dir} in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Los modulos se importan como scripts desde su carpeta, igual que en run_benchmarks.py
+sys.path.insert(0, os.path.join(ROOT, "gtfs_realtime"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
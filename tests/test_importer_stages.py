@@ -0,0 +1,67 @@
+import collections
+import json
+
+import pytest
+
+import importer_stages
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        # Como auto_explain, cada sentencia deja su plan como notice
+        plan = json.dumps({"sql": sql.strip()[:20]})
+        self.conn.notices.append(f"NOTICE:  duration: 1 ms  plan:\n{plan}")
+        if "fail" in sql:
+            raise RuntimeError("stage failed")
+        if sql.strip().startswith("INSERT INTO pipeline_runs"):
+            self.conn.saved.append(params[3])
+        self.result = [(0, 0, 0)] if "pg_stat_xact" in sql else [(0,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return []
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self):
+        self.notices = collections.deque()
+        self.saved = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_only_stage_plans_are_kept():
+    result = importer_stages.run_stage(FakeConnection(), "load", "SELECT 'stage';")
+    assert [json.loads(p) for p in result["plans"]] == [{"sql": "SELECT 'stage';"}]
+
+
+def test_completed_stages_survive_a_failure(tmp_path):
+    script = tmp_path / "importer.sql"
+    script.write_text("-- stage: first\nSELECT 1;\n-- stage: second\nSELECT fail;\n-- stage: third\nSELECT 3;\n")
+    conn = FakeConnection()
+    entry = {"script": script.name, "stages": []}
+    with pytest.raises(RuntimeError):
+        importer_stages.run_script(conn, str(script), "run", entry)
+    assert [r["stage"] for r in entry["stages"]] == ["first"]
+    assert entry["failed_stage"] == "second"
+    assert conn.saved == ["first"]
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import synthetic_data
+from live_delays import LiveDelayEngine, Schedule, to_metric
+
+
+@pytest.fixture(scope="module")
+def replay():
+    schedule = synthetic_data.generate_schedule(seed=1, routes=3, trips_per_route=3)
+    positions = synthetic_data.generate_vehicle_positions(schedule, seed=1, glitch_rate=0)
+    feeds = synthetic_data.generate_feed_snapshots(positions)
+
+    stops = schedule["stop_times"].merge(schedule["stops"], on="stop_id")
+    midnight = pd.Timestamp(synthetic_data.SERVICE_DATE, tz=synthetic_data.AGENCY_TIMEZONE)
+    stops["scheduled"] = midnight.timestamp() + pd.to_timedelta(stops["arrival_time"]).dt.total_seconds()
+    stops["x"], stops["y"] = to_metric.transform(stops["stop_lon"].to_numpy(), stops["stop_lat"].to_numpy())
+    return Schedule(stops[["trip_id", "stop_sequence", "stop_id", "scheduled", "x", "y"]]), feeds
+
+
+def run(schedule, feeds):
+    engine = LiveDelayEngine(schedule)
+    passages = []
+    for feed in feeds:
+        passages.extend(engine.process_feed(feed))
+    return pd.DataFrame(passages)
+
+
+def test_replay_from_start(replay):
+    schedule, feeds = replay
+    passages = run(schedule, feeds)
+    assert passages["trip_id"].nunique() == len(schedule.trip_ids)
+    assert passages["delay_seconds"].between(-120, 420).all()
+
+
+def test_replay_started_mid_trip(replay):
+    schedule, feeds = replay
+    late = feeds[40:]
+    active = {
+        e.vehicle.trip.trip_id for e in late[0].entity
+    } & {e.vehicle.trip.trip_id for e in late[5].entity}
+    assert active
+
+    passages = run(schedule, late)
+    # Los trips ya en curso se reubican en su secuencia de paradas y siguen detectando pasadas
+    assert active <= set(passages["trip_id"])
+    assert passages["delay_seconds"].between(-120, 420).all()
+    first_seen = passages.groupby("trip_id")["stop_sequence"].min()
+    assert (first_seen[sorted(active)] > 1).any()
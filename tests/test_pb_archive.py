@@ -0,0 +1,55 @@
+from definitions import gtfs_realtime_pb2
+from pb_archive import ArchiveReader, SegmentWriter
+
+
+def feed_message(timestamp, vehicle_id, trip_id=None):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = timestamp
+    entity = feed.entity.add()
+    entity.id = vehicle_id
+    vehicle = entity.vehicle
+    vehicle.vehicle.id = vehicle_id
+    if trip_id is not None:
+        vehicle.trip.trip_id = trip_id
+    vehicle.position.latitude = 50.08
+    vehicle.position.longitude = 14.42
+    vehicle.timestamp = timestamp
+    return feed.SerializeToString()
+
+
+def test_feeds_sharing_a_prefix_are_kept_apart(tmp_path):
+    # Segmentos chicos para que cada feed quede repartido en varios archivos
+    writers = {
+        name: SegmentWriter(str(tmp_path), name, max_segment_bytes=64)
+        for name in ("vp", "vp_extra")
+    }
+    for i in range(20):
+        t = 1_752_238_800 + 10 * i
+        for name, writer in writers.items():
+            writer.append(feed_message(t, f"{name}-bus", "trip"), fetch_time=t + 0.5)
+    for writer in writers.values():
+        writer.close()
+
+    for name in writers:
+        reader = ArchiveReader(str(tmp_path), name)
+        df = reader.vehicle_positions()
+        reader.close()
+        assert len(df) == 20
+        assert set(df["vehicle_id"]) == {f"{name}-bus"}
+        assert df["fetch_time"].is_monotonic_increasing
+
+
+def test_unset_fields_are_none(tmp_path):
+    writer = SegmentWriter(str(tmp_path), "vp")
+    writer.append(feed_message(1_752_238_800, "bus"), fetch_time=1_752_238_800)
+    writer.close()
+
+    reader = ArchiveReader(str(tmp_path), "vp")
+    df = reader.vehicle_positions(fields=("vehicle_id", "trip_id", "bearing", "timestamp"))
+    reader.close()
+    row = df.iloc[0]
+    assert row["vehicle_id"] == "bus"
+    assert row["trip_id"] is None
+    assert row["bearing"] is None
+    assert row["timestamp"] == 1_752_238_800
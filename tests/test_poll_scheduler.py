@@ -0,0 +1,53 @@
+import pytest
+
+import poll_scheduler
+from poll_scheduler import AdaptivePoller
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def simulate(monkeypatch, interval, header_rate, duration=600, latency=0.05):
+    """
+    Polls a feed that publishes every `interval` wall seconds and whose
+    header clock runs `header_rate` times faster than the wall clock.
+    Returns the poller and the fraction of the publishes fetched in the
+    second half of the run.
+    """
+    t0 = 1_750_000_000.0
+    clock = FakeClock(t0)
+    monkeypatch.setattr(poll_scheduler.time, "time", clock.time)
+    poller = AdaptivePoller("test")
+    fetched = set()
+    while clock.now < t0 + duration:
+        clock.now = max(clock.now, poller.next_poll)
+        started = clock.now
+        k = int((started + latency / 2 - t0) // interval)
+        header = t0 + k * interval * header_rate
+        if poller.record(started, started + latency, float(int(header)), str(k).encode()):
+            fetched.add(k)
+        clock.now = started + latency
+    half = int(duration / 2 / interval)
+    published = range(half, int(duration / interval))
+    return poller, len(fetched & set(published)) / len(published)
+
+
+def test_header_clock_in_wall_time(monkeypatch):
+    poller, coverage = simulate(monkeypatch, interval=20, header_rate=1)
+    assert poller.cadence == pytest.approx(20, abs=1)
+    assert coverage == 1
+    assert poller.metrics()["polls_per_snapshot"] < 1.5
+
+
+@pytest.mark.parametrize("header_rate", [10, 0.1])
+def test_header_clock_at_another_rate(monkeypatch, header_rate):
+    # p.ej. una captura reproducida a 10x con los timestamps originales
+    poller, coverage = simulate(monkeypatch, interval=2, header_rate=header_rate)
+    assert poller.cadence == pytest.approx(2, abs=0.5)
+    assert coverage > 0.9
+    assert poller.metrics()["staleness_mean_s"] < 2
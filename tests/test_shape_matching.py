@@ -0,0 +1,35 @@
+import numpy as np
+import shapely
+
+from shape_matching import snap_to_shape, to_wgs84
+
+# Centro de Praga en S-JTSK
+ORIGIN = np.array([-743000.0, -1043000.0])
+
+
+def shape(*coords):
+    return shapely.linestrings(ORIGIN + np.array(coords, dtype=float))
+
+
+def trip_points(*coords):
+    xy = ORIGIN + np.array(coords, dtype=float)
+    lon, lat = to_wgs84.transform(xy[:, 0], xy[:, 1])
+    return [{"lon": lon[i], "lat": lat[i], "time": 20 * i} for i in range(len(xy))]
+
+
+def test_snap_follows_a_straight_shape():
+    line = shape((0, 0), (1000, 0))
+    # El ruido del GPS puede hacer retroceder unos metros al vehiculo detenido
+    points = trip_points((0, 5), (300, -5), (295, 4), (600, 0), (1000, 3))
+    matched, pieces = snap_to_shape(points, line)
+    assert matched is not None
+    assert len(matched) == len(points)
+    assert len(pieces) == 1
+
+
+def test_loop_shape_falls_back_to_valhalla():
+    # Sale por la calle, da la vuelta a la manzana y vuelve por la misma calle
+    line = shape((0, 0), (1000, 0), (1500, 0), (1500, 500), (1000, 500), (1000, 0), (0, 0))
+    points = trip_points((100, 0), (900, 0), (1500, 250), (1000, 250), (900, 0), (100, 0))
+    # Todos los puntos estan sobre la shape, pero la vuelta se proyecta sobre la ida
+    assert snap_to_shape(points, line) == (None, None)
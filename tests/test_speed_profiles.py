@@ -0,0 +1,34 @@
+import pytest
+
+from speed_comparison import speed_diff_ranges
+from speed_profiles import SpeedProfiles
+
+
+def row(stop1, stop2, kind, speeds, hour=8):
+    bins = sorted({int(s // 2) for s in speeds})
+    counts = [sum(int(s // 2) == b for s in speeds) for b in bins]
+    return (stop1, stop2, hour, "3", kind, len(speeds), sum(speeds), min(speeds), max(speeds), bins, counts)
+
+
+def test_diff_only_uses_the_observed_shapes():
+    profiles = SpeedProfiles.from_rows(
+        [
+            # Dos shapes pasan por s1-s2; solo la lenta tiene pasadas observadas
+            row("s1", "s2", "scheduled", [20, 20, 60, 60]),
+            row("s1", "s2", "scheduled_observed", [20, 20]),
+            row("s1", "s2", "observed", [18, 16]),
+            # Segmento sin observaciones: no entra en las diferencias
+            row("s2", "s3", "scheduled", [30]),
+        ]
+    )
+    diffs = profiles.speed_diffs()
+    assert diffs.to_dict() == {("s1", "s2"): -3}
+    assert speed_diff_ranges(profiles) == [("-5 to 0", 1)]
+
+
+def test_stale_profiles_are_rejected():
+    profiles = SpeedProfiles.from_rows(
+        [row("s1", "s2", "scheduled", [20]), row("s1", "s2", "observed", [18])]
+    )
+    with pytest.raises(ValueError):
+        profiles.speed_diffs()